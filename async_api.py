@@ -0,0 +1,189 @@
+"""asyncio API of the conversion, for editor extensions and language server sidecars that embed the converter
+instead of running classpath_installer.py:
+
+    converter = AsyncConverter("~/.p2", "~/.eclipse_vs_code_cache", on_progress=print)
+    written = await converter.convert("~/git/raox", "ru.bmstu.rk9.rao ru.bmstu.rk9.rao.lib")
+
+or `await convert(workspace, modules, p2, cache_folder)` for a one-off conversion.
+Jar reads, resolution and file writes run on worker threads, the event loop only awaits them.
+Nothing is printed: the messages of the conversion reach the listeners as "message" events.
+The converter keeps the parsed pool between conversions, call refresh_pool when the pool changes.
+"""
+import asyncio
+import os
+from contextlib import contextmanager
+from typing import Callable, List
+from conversion import WorkspaceConversion, convert_code_to_eclipse
+from dependency import P2Catalog, WorkspaceIndex, report
+
+
+class ProgressEvent:
+    '''Step a conversion of a workspace has reached. Write events also carry the submodule written
+    and how many of the submodules are done, message events the text the command line would print
+    '''
+    __slots__ = ("workspace", "phase", "module", "done", "total", "message")
+
+    def __init__(self, workspace: str, phase: str, module: str = None, done: int = 0, total: int = 0,
+                 message: str = None):
+        self.workspace = workspace
+        self.phase = phase
+        self.module = module
+        self.done = done
+        self.total = total
+        self.message = message
+
+    def __str__(self):
+        progress = f" {self.done}/{self.total}" if self.total != 0 else ""
+        module = f" {self.module}" if self.module is not None else ""
+        message = f" {self.message}" if self.message is not None else ""
+        return f"{self.workspace}: {self.phase}{module}{progress}{message}"
+
+
+class ConversionSuperseded(Exception):
+    '''A newer conversion of the same workspace took over. Not a cancellation: the caller was not cancelled
+    '''
+    def __init__(self, workspace: str):
+        super().__init__(f"{workspace}: superseded by a newer conversion")
+        self.workspace = workspace
+
+
+async def run_step(function, *args):
+    '''Runs a blocking step on a worker thread. A cancelled step is still waited for before the cancellation
+    goes on, so the next conversion never shares the resolver with a step that is running
+    '''
+    step = asyncio.ensure_future(asyncio.to_thread(function, *args))
+    try:
+        return await asyncio.shield(step)
+    except asyncio.CancelledError:
+        await asyncio.wait([step])
+        raise
+
+
+class AsyncConverter:
+    '''Converts workspaces against one p2 pool and cache folder, submodules of all of them share the parsed
+    bundles. Conversions run one at a time. A newer conversion of a workspace cancels the one in flight,
+    which stops at the end of its current step: a classpath is never written from a superseded manifest
+    once a newer one is being converted, and submodules it did not write are converted again by the next run
+    '''
+    def __init__(self, p2: str, cache_folder: str, jobs: int = None, on_progress: Callable[[ProgressEvent], None] = None):
+        self.p2 = os.path.expanduser(p2)
+        self.cache_folder = os.path.expanduser(cache_folder)
+        self.jobs = jobs if jobs is not None else os.cpu_count() or 1
+        self.resolver = None
+        self.lock = asyncio.Lock()
+        # workspace path -> task converting it
+        self.running = {}
+        # tasks cancelled by a newer conversion of their workspace
+        self.superseded = set()
+        self.listeners = [on_progress] if on_progress is not None else []
+
+    def emit(self, workspace: str, phase: str, module: str = None, done: int = 0, total: int = 0, message: str = None):
+        event = ProgressEvent(workspace, phase, module, done, total, message)
+        for listener in list(self.listeners):
+            listener(event)
+
+    async def events(self):
+        '''Progress events of all conversions, for as long as the caller iterates
+        '''
+        queue = asyncio.Queue()
+        self.listeners.append(queue.put_nowait)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.listeners.remove(queue.put_nowait)
+
+    async def convert(self, workspace: str, modules, clean_cache=False, incremental=False, classpath_jar=False,
+                      prune=False) -> List[str]:
+        '''Converts the submodules (a list or names split by space) to code.
+        Returns the submodules whose classpath was written, the others were up to date.
+        Raises ConversionSuperseded when a newer conversion of the workspace superseded this one
+        '''
+        workspace = os.path.expanduser(workspace)
+        modules = modules.strip().split() if isinstance(modules, str) else list(modules)
+        key = os.path.abspath(workspace)
+        previous = self.running.get(key)
+        if previous is not None:
+            self.superseded.add(previous)
+            previous.cancel()
+        task = asyncio.ensure_future(self.run(workspace, modules, clean_cache, incremental, classpath_jar, prune))
+        self.running[key] = task
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if task not in self.superseded:
+                self.emit(workspace, "cancelled")
+                raise
+            self.emit(workspace, "superseded")
+            raise ConversionSuperseded(workspace) from None
+        finally:
+            self.superseded.discard(task)
+            if self.running.get(key) is task:
+                del self.running[key]
+
+    @contextmanager
+    def reporting(self, workspace: str):
+        '''Messages of the conversion become events of the workspace instead of lines on stdout.
+        Steps report from worker threads, the listeners are still called on the event loop
+        '''
+        loop = asyncio.get_running_loop()
+        report.listener = lambda text: loop.call_soon_threadsafe(lambda: self.emit(workspace, "message", message=text))
+        try:
+            yield
+        finally:
+            report.listener = None
+
+    async def run(self, workspace: str, modules: List[str], clean_cache, incremental, classpath_jar, prune) -> List[str]:
+        async with self.lock:
+            with self.reporting(workspace):
+                return await self.convert_steps(workspace, modules, clean_cache, incremental, classpath_jar, prune)
+
+    async def convert_steps(self, workspace: str, modules: List[str], clean_cache, incremental, classpath_jar,
+                            prune) -> List[str]:
+        self.emit(workspace, "read manifests")
+        index = WorkspaceIndex.for_root(workspace)
+        if index.built:
+            # a manifest may have renamed its bundle since the last conversion
+            await run_step(index.build)
+        conversion = await run_step(WorkspaceConversion, workspace, modules, self.p2, self.cache_folder, clean_cache,
+                                    self.jobs, incremental, self.resolver, classpath_jar, prune)
+        self.resolver = conversion.resolver
+        await run_step(conversion.prepare)
+        await run_step(conversion.read_manifests)
+        self.emit(workspace, "read jars")
+        await run_step(conversion.prefetch)
+        self.emit(workspace, "resolve")
+        resolved = await run_step(conversion.resolve)
+        written = []
+        for done, (bundle, resolution) in enumerate(resolved, 1):
+            # the classpath and then the closure cache of the submodule are written in one step: a conversion
+            # cancelled before it leaves the old cache, which no longer matches the manifest
+            await run_step(conversion.write_module, bundle, resolution)
+            if resolution is not None:
+                written.append(bundle.name)
+            self.emit(workspace, "write", bundle.name, done, len(resolved))
+        await run_step(conversion.save)
+        self.emit(workspace, "done", done=len(resolved), total=len(resolved))
+        return written
+
+    async def convert_to_eclipse(self, workspace: str, modules):
+        workspace = os.path.expanduser(workspace)
+        modules = modules.strip().split() if isinstance(modules, str) else list(modules)
+        async with self.lock:
+            with self.reporting(workspace):
+                await run_step(convert_code_to_eclipse, workspace, modules, self.p2)
+            self.emit(workspace, "done")
+
+    async def refresh_pool(self):
+        '''Rescans the pool: other jars, other versions, the graph is rebuilt on the next conversion
+        '''
+        async with self.lock:
+            await run_step(P2Catalog.for_repository(self.p2).scan)
+            self.resolver = None
+
+
+async def convert(workspace: str, modules, p2: str, cache_folder: str, on_progress: Callable[[ProgressEvent], None] = None,
+                  **options) -> List[str]:
+    '''Converts the submodules of the workspace to code, see AsyncConverter.convert for the options
+    '''
+    return await AsyncConverter(p2, cache_folder, on_progress=on_progress).convert(workspace, modules, **options)
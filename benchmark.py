@@ -0,0 +1,279 @@
+"""Benchmarks of the conversion on a generated p2 pool and Eclipse workspace.
+Every run generates the same pool for the same arguments, so results of different commits can be compared.
+args:
+-o output json file with the results
+-compare json file of a previous run, the ratios to it are printed
+-work folder where the pool and the workspace are generated, a temporary folder by default.
+Its p2, workspace and cache subfolders are replaced, other files are kept
+-jars number of bundles in the pool
+-fanout number of bundles each bundle requires
+-reexport share of requirements that are reexported
+-cycles number of reexport cycles
+-versions share of bundles that also have an older version in the pool
+-modules number of submodules in the workspace
+-repeat number of times each step is timed, the median is kept
+-seed seed of the generator
+"""
+from pathlib import Path
+from typing import List
+import argparse
+import json
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from dependency import *
+
+
+classpath_template = '''<?xml version="1.0" encoding="UTF-8"?>
+<classpath>
+\t<classpathentry kind="con" path="org.eclipse.jdt.launching.JRE_CONTAINER"/>
+\t<classpathentry kind="src" path="src"/>
+\t<classpathentry kind="output" path="bin"/>
+</classpath>
+'''
+
+
+def bundle_name(index: int) -> str:
+    return f"org.bench.b{index}"
+
+
+def manifest_text(name: str, version: str, requirements: List[str]) -> str:
+    lines = ["Manifest-Version: 1.0", f"Bundle-SymbolicName: {name};singleton:=true", f"Bundle-Version: {version}"]
+    if len(requirements) != 0:
+        header = "Require-Bundle: " + ",".join(requirements)
+        # manifest lines are folded at 72 bytes like the jar tool does
+        lines.append(header[:72] + "".join(map(lambda x: "\n " + header[x:x + 71], range(72, len(header), 71))))
+    lines.append(f"Export-Package: {name}")
+    return "\n".join(lines) + "\n\n"
+
+
+def write_jar(file: Path, manifest: str, classes: int):
+    with zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED) as jar:
+        jar.writestr(manifest_path, manifest)
+        for i in range(classes):
+            jar.writestr(f"{file.stem.replace('.', '/')}/C{i}.class", b"\xca\xfe\xba\xbe" * 64)
+
+
+def generate_pool(p2: Path, jars: int, fanout: int, reexport: float, cycles: int, versions: float, rng: random.Random):
+    '''Bundles only require bundles with a lower index, cycles are added on top as pairs that reexport each other
+    '''
+    plugins = p2.joinpath(plugins_subpath)
+    plugins.mkdir(parents=True)
+    requirements = []
+    for index in range(jars):
+        targets = rng.sample(range(index), min(fanout, index))
+        requirements.append(list(map(lambda x: bundle_name(x) + (";visibility:=reexport" if rng.random() < reexport else ""),
+                                     targets)))
+    for _ in range(min(cycles, jars // 2)):
+        first, second = rng.sample(range(jars), 2)
+        requirements[first].append(bundle_name(second) + ";visibility:=reexport")
+        requirements[second].append(bundle_name(first) + ";visibility:=reexport")
+    for index in range(jars):
+        name = bundle_name(index)
+        jar_versions = ["2.0.0.v20240101"]
+        if rng.random() < versions:
+            jar_versions.append("1.0.0.v20200101")
+        for version in jar_versions:
+            write_jar(plugins.joinpath(f"{name}_{version}.jar"), manifest_text(name, version, requirements[index]), 20)
+            write_jar(plugins.joinpath(f"{name}{source_bundle_suffix}_{version}.jar"), "Manifest-Version: 1.0\n\n", 0)
+
+
+def generate_workspace(workspace: Path, modules: int, jars: int, fanout: int, rng: random.Random) -> List[str]:
+    names = []
+    for index in range(modules):
+        name = f"org.bench.module{index}"
+        folder = workspace.joinpath(name)
+        folder.joinpath("META-INF").mkdir(parents=True)
+        folder.joinpath(".settings").mkdir()
+        requirements = list(map(lambda x: bundle_name(x), rng.sample(range(jars), min(fanout, jars))))
+        # modules depend on each other like real multi-module projects
+        requirements.extend(names[-1:])
+        folder.joinpath(manifest_path).write_text(manifest_text(name, "1.0.0.qualifier", requirements))
+        folder.joinpath(classpath_file_subpath).write_text(classpath_template)
+        names.append(name)
+    return names
+
+
+def forget_shared_state():
+    '''What a new process of the converter would not have in memory
+    '''
+    P2Catalog._shared.clear()
+    JarMetadataStore._shared.clear()
+    P2Index._shared.clear()
+    P2Index._repositories.clear()
+    PackageIndex._shared.clear()
+    WorkspaceIndex._shared.clear()
+
+
+def measure(step, repeat: int, prepare=None) -> float:
+    timings = []
+    for _ in range(repeat):
+        if prepare is not None:
+            prepare()
+        started = time.perf_counter()
+        step()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def pool_bundles(p2: Path, cache_folder: str) -> List[Bundle]:
+    catalog = P2Catalog.for_repository(p2)
+    catalog.scan_if_must()
+    return list(map(lambda x: Bundle(p2, x, cache_folder=cache_folder), sorted(catalog.entries.keys())))
+
+
+def module_bundles(p2: Path, workspace: Path, modules: List[str], cache_folder: str) -> List[Bundle]:
+    return list(map(lambda x: Bundle(p2, x, Project(workspace, x), cache_folder), modules))
+
+
+def run_converter(workspace: Path, modules: List[str], p2: Path, cache_folder: str, *extra: str):
+    installer = Path(__file__).resolve().parent.joinpath("classpath_installer.py")
+    command = [sys.executable, str(installer), str(workspace), " ".join(modules), "-p2", str(p2), *extra]
+    if "-ce" not in extra:
+        command.extend(["-cache_path", cache_folder])
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+
+
+def benchmark(p2: Path, workspace: Path, modules: List[str], cache_folder: str, repeat: int) -> dict:
+    results = {}
+
+    def cold():
+        forget_shared_state()
+        shutil.rmtree(cache_folder, ignore_errors=True)
+
+    def warm():
+        forget_shared_state()
+
+    def fill_cache(*extra: str):
+        cold()
+        run_converter(workspace, modules, p2, cache_folder, "-ce")
+        run_converter(workspace, modules, p2, cache_folder, *extra)
+
+    def time_step(name, step, before=lambda: None, extra=(), fill=fill_cache):
+        '''Cold runs start without the cache folder, warm ones with the cache folder a conversion
+        with the same extra arguments left behind
+        '''
+        results[name] = {}
+        results[name]["cold"] = measure(step, repeat, lambda: (cold(), before()))
+        fill(*extra)
+        results[name]["warm"] = measure(step, repeat, lambda: (warm(), before()))
+        print(f"{name}: cold {results[name]['cold'] * 1000:.1f} ms | warm {results[name]['warm'] * 1000:.1f} ms")
+
+    bundles = []
+
+    def load_pool_bundles():
+        bundles[:] = pool_bundles(p2, cache_folder)
+
+    def load_pool_bundles_with_jars():
+        load_pool_bundles()
+        list(map(lambda x: x.update_jars(), bundles))
+
+    def update_dependencies():
+        list(map(lambda x: x.update_dependencies(), bundles))
+
+    def fill_metadata_store():
+        '''A conversion only parses the jars its modules reach, the step parses the whole pool
+        '''
+        fill_cache()
+        load_pool_bundles_with_jars()
+        update_dependencies()
+        JarMetadataStore.save_shared()
+
+    def load_modules():
+        bundles[:] = module_bundles(p2, workspace, modules, cache_folder)
+        list(map(lambda x: x.update_dependencies(), bundles))
+
+    def collect():
+        resolver = DependencyResolver(p2, cache_folder)
+        list(map(lambda x: x.collect_exported_dependencies(resolver), bundles))
+
+    def merge():
+        resolver = DependencyResolver(p2, cache_folder)
+        list(map(lambda x: x.merge_with_classpath(resolver=resolver), bundles))
+
+    def convert_back():
+        run_converter(workspace, modules, p2, cache_folder, "-ce")
+
+    time_step("update_jars", lambda: list(map(lambda x: x.update_jars(), bundles)), load_pool_bundles)
+    time_step("update_dependencies", update_dependencies, load_pool_bundles_with_jars, fill=fill_metadata_store)
+    time_step("collect_exported_dependencies", collect, load_modules)
+    time_step("merge_with_classpath", merge, lambda: (convert_back(), load_modules()))
+    time_step("convert_eclipse_to_code", lambda: run_converter(workspace, modules, p2, cache_folder), convert_back)
+    # the index is kept in the cache folder, so cold runs start without it and fill it
+    shared_index = ("-shared_index", cache_folder)
+    time_step("convert_eclipse_to_code_shared_index",
+              lambda: run_converter(workspace, modules, p2, cache_folder, *shared_index), convert_back, shared_index)
+    return results
+
+
+def compare(results: dict, previous_file: str):
+    with open(previous_file, 'r') as readable:
+        previous = json.load(readable)["results"]
+    for name, timings in results.items():
+        for kind, seconds in timings.items():
+            before = previous.get(name, {}).get(kind)
+            if before:
+                print(f"{name} {kind}: {seconds / before:.2f}x of {previous_file}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=Path(__file__).resolve().parent,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times the conversion steps on a generated p2 pool")
+    parser.add_argument("-o", dest="output", default="benchmark.json", help="JSON file to write the results to")
+    parser.add_argument("-compare", dest="compare", default=None, help="JSON results of a previous run")
+    parser.add_argument("-work", dest="work", default=None, help="Folder to generate the pool and the workspace in")
+    parser.add_argument("-jars", dest="jars", type=int, default=1000)
+    parser.add_argument("-fanout", dest="fanout", type=int, default=4)
+    parser.add_argument("-reexport", dest="reexport", type=float, default=0.3)
+    parser.add_argument("-cycles", dest="cycles", type=int, default=5)
+    parser.add_argument("-versions", dest="versions", type=float, default=0.2)
+    parser.add_argument("-modules", dest="modules", type=int, default=10)
+    parser.add_argument("-repeat", dest="repeat", type=int, default=3)
+    parser.add_argument("-seed", dest="seed", type=int, default=1)
+    args = parser.parse_args()
+
+    work = Path(args.work if args.work is not None else tempfile.mkdtemp(prefix="etvsc-bench-"))
+    rng = random.Random(args.seed)
+    p2 = work.joinpath("p2")
+    workspace = work.joinpath("workspace")
+    cache_folder = str(work.joinpath("cache"))
+    # only what an earlier run generated is removed, the folder given with -work may hold other files
+    for generated in (p2, workspace, cache_folder):
+        shutil.rmtree(generated, ignore_errors=True)
+    started = time.perf_counter()
+    generate_pool(p2, args.jars, args.fanout, args.reexport, args.cycles, args.versions, rng)
+    modules = generate_workspace(workspace, args.modules, args.jars, args.fanout * 4, rng)
+    print(f"generated {args.jars} bundles and {args.modules} modules in {work} in {time.perf_counter() - started:.1f} s")
+
+    results = benchmark(p2, workspace, modules, cache_folder, args.repeat)
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": dict(filter(lambda x: x[0] not in ("output", "compare", "work"), vars(args).items())),
+        "results": results,
+    }
+    with open(args.output, 'w') as writable:
+        json.dump(report, writable, indent=4)
+    print(f"results written to {args.output}")
+    if args.compare is not None:
+        compare(results, args.compare)
+    if args.work is None:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,55 @@
 """Accepts the following arguments:
-1. (necessary) path of the project eclipse
-2. (necessary) string with names of submodules split by space
+1. (necessary unless -batch is given) path of the project eclipse
+2. (necessary unless -batch is given) string with names of submodules split by space
 
 -p2 path to p2 repository
 -cc convert eclipse project to the code one
 -ce convert code project back to the eclipse one
+-incremental resolve only requirements added since the last conversion and patch .classpath in place
+-shared_index use the p2 index shared by all workspaces converted on this machine, stored next to the pool
+or in the given folder
+-batch convert all workspaces listed in a JSON or TOML job file in one process, e.g.
+    {"p2": "~/.p2", "cache_path": "~/.eclipse_vs_code_cache",
+     "workspaces": [{"path": "~/git/raox", "modules": "ru.bmstu.rk9.rao ru.bmstu.rk9.rao.lib"},
+                    {"path": "~/git/other", "modules": ["other.core"], "to_eclipse": true}]}
+    p2, cache_path, clean_cache, incremental, to_eclipse, classpath_jar, prune, plan and graph given at the top are the defaults
+    of every workspace, a graph shared by several workspaces is written to one numbered file per workspace,
+    the command line arguments are the defaults of the file
+-prune keep only the bundles exporting packages the sources of a submodule import, with the bundles they reexport
+--plan resolve and print what would change in each .classpath, without writing any file
+--graph write the resolved dependency graph to the given .json or .dot file: requirements with their reexport flag,
+jar sizes of the bundles and classpath sizes of the submodules
+-classpath_jar put one jar into .classpath of each submodule, its manifest lists the resolved jars in Class-Path.
+The jar is kept in the cache folder, source attachments are not available in this mode.
+Running with or without -classpath_jar regenerates a classpath made in the other mode
+-w/--watch keep running after the conversion and re-sync .classpath files on manifest or p2 pool changes
+-j/--jobs number of parallel workers reading p2 jars (defaults to the number of cores)
+When only the paths, -p2, -cache_path, -cc, -incremental and -j are given and every submodule is already converted
+from its current manifest and p2 pool, the script exits after reading the caches, without loading the converter
+--profile print the time spent in each phase and the counters of the work done
+--stats-json write the phase times and counters to the given json file
+--profile-dump write a trace of the phases (.json, for chrome://tracing or Perfetto) or a cProfile dump (any other name)
 
 if -cc is set, -p2 must also be set
 if -ce is set, will definitely convert back to eclipse format
 by default -cc is true so p2 must also be given if no -ce is encounterd
 
 """
+import sys
+from fast_path import already_converted
+
+# warm start: when every module is converted from its current manifest and pool, exit before
+# argparse, the parsers and the resolver are even imported
+if __name__ == "__main__" and already_converted(sys.argv[1:]):
+    sys.exit(0)
+
 from pathlib import Path, PurePosixPath
+import os
 import re
+import time
 import argparse
 from dependency import *
+from conversion import convert_eclipse_to_code, convert_code_to_eclipse
 
 DEBUG = True
 # CONSTS
@@ -24,8 +59,8 @@ dependency_declaration_subpath = "META-INF/MANIFEST.MF"
 
 parser = argparse.ArgumentParser()
 
-parser.add_argument('eclipse_project_path', help='Eclipse project path')
-parser.add_argument('submodules_paths',
+parser.add_argument('eclipse_project_path', help='Eclipse project path', nargs="?")
+parser.add_argument('submodules_paths', nargs="?",
                     help="Eclipse project submodules paths which are relative to the given root", type=str)
 parser.add_argument("-p2", "--p2repository", dest="p2",
                     help="Path to local p2 repository")
@@ -37,56 +72,216 @@ parser.add_argument("-clean_cache", dest="clean_cache",
                     action="store_const", const=True, default=False)
 parser.add_argument("-cache_path", dest="cache_folder", type=str,
                     help="Path to the cache folder to store parsed dependencies")
+parser.add_argument("-incremental", dest="incremental", action="store_const", const=True, default=False,
+                    help="Resolve only requirements added to the manifests since the last conversion and patch the classpath")
+parser.add_argument("-shared_index", dest="shared_index", nargs="?", const="", default=None,
+                    help="Share parsed jars and resolved closures with other workspaces through an index stored next to "
+                         "the p2 pool, or in the given folder")
+parser.add_argument("-batch", dest="batch", type=str, default=None,
+                    help="JSON or TOML file listing the workspaces and submodules to convert in one process")
+parser.add_argument("-prune", dest="prune", action="store_const", const=True, default=False,
+                    help="Keep only the bundles whose packages are imported by the sources of the submodule")
+parser.add_argument("--plan", dest="plan", action="store_const", const=True, default=False,
+                    help="Resolve and print the changes each .classpath would get, without writing anything")
+parser.add_argument("--graph", dest="graph", type=str, default=None,
+                    help="Write the resolved dependency graph to this .json or .dot file")
+parser.add_argument("-classpath_jar", dest="classpath_jar", action="store_const", const=True, default=False,
+                    help="Reference the resolved jars through one generated jar with a Class-Path manifest")
+parser.add_argument("-w", "--watch", dest="watch", action="store_const", const=True, default=False,
+                    help="Keep running and re-sync .classpath files when manifests or the p2 pool change")
+parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=os.cpu_count() or 1,
+                    help="Number of workers reading p2 jars in parallel, 1 reads them one by one")
+parser.add_argument("--profile", dest="profile", action="store_const", const=True, default=False,
+                    help="Print the time spent in each phase and counters of jars opened, manifests parsed, cache hits")
+parser.add_argument("--stats-json", dest="stats_json", type=str, default=None,
+                    help="Write the phase times and counters to this json file")
+parser.add_argument("--profile-dump", dest="profile_dump", type=str, default=None,
+                    help="Write trace events (.json file) or a cProfile dump (other files) for a flame graph viewer")
 args = parser.parse_args()
 
 to_code = args.to_code and not args.to_eclipse
 cache_folder = args.cache_folder
-print("eclipse project path {} \n submodules relative paths {} \n p2 repository path {} \n will convert to code {} and will clean cache {} in cache folder {}".format(
-    args.eclipse_project_path,
-    args.submodules_paths,
-    args.p2,
-    to_code,
-    args.clean_cache,
-    cache_folder
-))
-assert (to_code and args.p2 is not None) or not to_code, "Tried to convert to code format but no path to p2 repository was given"
-assert (cache_folder is not None or not to_code), "Cache folder must not be null if convert to code"
+if args.batch is None:
+    print("eclipse project path {} \n submodules relative paths {} \n p2 repository path {} \n will convert to code {} and will clean cache {} in cache folder {}".format(
+        args.eclipse_project_path,
+        args.submodules_paths,
+        args.p2,
+        to_code,
+        args.clean_cache,
+        cache_folder
+    ))
+    assert args.eclipse_project_path is not None and args.submodules_paths is not None, "Eclipse project path and submodules must be given unless -batch is used"
+    assert (to_code and args.p2 is not None) or not to_code, "Tried to convert to code format but no path to p2 repository was given"
+    assert (cache_folder is not None or not to_code), "Cache folder must not be null if convert to code"
 # PREPARE THE INPUT
 eclipse_project_path = args.eclipse_project_path
-submodules_relative_paths = args.submodules_paths.strip().split()
+submodules_relative_paths = (args.submodules_paths or "").strip().split()
 clean_cache = args.clean_cache
 submodules_relative_paths = list(
     map(lambda x: x.strip(), submodules_relative_paths))
 
-print(submodules_relative_paths)
+if args.batch is None:
+    print(submodules_relative_paths)
 
 # MAIN CODE
 
 
-def convert_eclipse_to_code(project_path1, modules: List[str], cache_folder: str, clean_cache=False):
-    projects = list(map(lambda x: Project(project_path1, x), modules))
-    project_bundles = list(map(lambda x: Bundle(
-        args.p2, x.module_root, x, cache_folder), projects))
-    configure_vs_code_settings(Path(project_path1))
-    for i in project_bundles:
-        i.update_dependencies()
-        print(i)
-        # cache dependencies and merge classpath files of each submodule
-        i.merge_with_classpath(clean_cache=clean_cache)
-        # need to add magic line if there is no such - makes some red highlight go away
-        i.add_magic_line_to_settings()
+def watch_eclipse_to_code(project_path: str, modules: List[str], cache_folder: str, resolver: DependencyResolver, jobs=1):
+    '''Keeps the p2 catalog and the resolved graph in memory and re-syncs the classpath
+    of a submodule as soon as its manifest changes, or of all submodules when the pool changes
+    '''
+    from watch import PollingWatcher
+    manifests = dict(map(lambda x: (str(Project(project_path, x).module_path().joinpath(manifest_path)), x), modules))
+    plugins = str(Path(args.p2).joinpath(plugins_subpath))
+    state = {"resolver": resolver}
+
+    def on_change(paths: List[str]):
+        started = time.perf_counter()
+        if plugins in paths:
+            # other jars, other versions: the graph is rebuilt, parsed jars come from the metadata store
+            P2Catalog.for_repository(args.p2).scan()
+            state["resolver"] = DependencyResolver(args.p2, cache_folder, jobs=jobs)
+            changed_modules = modules
+        else:
+            changed_modules = list(map(lambda x: manifests[x], filter(lambda x: x in manifests, paths)))
+        # editors that save by renaming and checkouts remove a manifest for a moment, it is re-synced when it is back
+        missing = set(filter(lambda x: not Project(project_path, x).module_path().joinpath(manifest_path).is_file(),
+                             changed_modules))
+        for module in missing:
+            print(f"{module}: no manifest for now, skipped")
+        changed_modules = list(filter(lambda x: x not in missing, changed_modules))
+        if len(changed_modules) == 0:
+            return
+        # a manifest may have renamed its bundle
+        WorkspaceIndex.for_root(project_path).build()
+        convert_eclipse_to_code(project_path, changed_modules, cache_folder, jobs=jobs, incremental=True,
+                                resolver=state["resolver"], p2=args.p2, classpath_jar=args.classpath_jar, prune=args.prune)
+        print(f"re-synced {' '.join(changed_modules)} in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    watcher = PollingWatcher(list(manifests.keys()) + [plugins])
+    print(f"watching {len(manifests)} manifests and {plugins}, press Ctrl+C to stop")
+    try:
+        watcher.run(on_change)
+    except KeyboardInterrupt:
+        print("stopped watching")
+
+
+def read_batch_file(file: str) -> dict:
+    if file.endswith(".toml"):
+        try:
+            import tomllib
+        except ImportError:
+            raise SystemExit("TOML job files need Python 3.11 or newer, use a JSON job file instead")
+        with open(file, 'rb') as readable:
+            return tomllib.load(readable)
+    with open(file, 'r') as readable:
+        return load(readable)
+
+
+def batch_jobs(batch: dict) -> List[dict]:
+    '''Workspaces of the job file with the defaults of the file and of the command line filled in
+    '''
+    defaults = {
+        "p2": batch.get("p2", args.p2),
+        "cache_path": batch.get("cache_path", args.cache_folder),
+        "clean_cache": batch.get("clean_cache", args.clean_cache),
+        "incremental": batch.get("incremental", args.incremental),
+        "to_eclipse": batch.get("to_eclipse", args.to_eclipse),
+        "classpath_jar": batch.get("classpath_jar", args.classpath_jar),
+        "prune": batch.get("prune", args.prune),
+        "plan": batch.get("plan", args.plan),
+        "graph": batch.get("graph", args.graph),
+    }
+    jobs = []
+    for workspace in batch.get("workspaces", []):
+        job = dict(defaults)
+        job.update(workspace)
+        modules = job.get("modules", [])
+        job["modules"] = modules.strip().split() if isinstance(modules, str) else list(modules)
+        for key in ("path", "p2", "cache_path", "graph"):
+            if job.get(key) is not None:
+                job[key] = os.path.expanduser(job[key])
+        jobs.append(job)
+    graphs = list(filter(lambda x: x["graph"] is not None, jobs))
+    if len(graphs) > 1 and len(set(map(lambda x: x["graph"], graphs))) < len(graphs):
+        # one graph per workspace: graph.json becomes graph.1.json, graph.2.json...
+        for number, job in enumerate(graphs, 1):
+            stem, suffix = os.path.splitext(job["graph"])
+            job["graph"] = f"{stem}.{number}{suffix}"
+    return jobs
+
+
+def run_batch(file: str) -> List[str]:
+    '''Converts every workspace of the job file, workspaces converted against the same pool share
+    its catalog and the dependency graph. Returns the paths of the workspaces that failed
+    '''
+    jobs = batch_jobs(read_batch_file(file))
+    resolvers = {}
+    failed = []
+    for job in jobs:
+        started = time.perf_counter()
+        path = job.get("path")
+        try:
+            assert path is not None and len(job["modules"]) != 0, "workspace path and modules must be given"
+            if job["to_eclipse"]:
+                convert_code_to_eclipse(path, job["modules"], p2=job["p2"], plan=job["plan"])
+            else:
+                assert job["p2"] is not None, "Tried to convert to code format but no path to p2 repository was given"
+                assert job["cache_path"] is not None, "Cache folder must not be null if convert to code"
+                if args.shared_index is not None:
+                    P2Index.for_repository(job["p2"], args.shared_index or None, read_only=job["plan"])
+                key = (os.path.abspath(job["p2"]), os.path.abspath(job["cache_path"]))
+                resolvers[key] = convert_eclipse_to_code(
+                    path, job["modules"], job["cache_path"], job["clean_cache"], jobs=args.jobs,
+                    incremental=job["incremental"], resolver=resolvers.get(key), p2=job["p2"],
+                    classpath_jar=job["classpath_jar"], prune=job["prune"], plan=job["plan"], graph_file=job["graph"])
+        except (AssertionError, OSError, ValueError) as error:
+            print(f"{path}: conversion failed: {error}")
+            failed.append(str(path))
+            continue
+        print(f"{path}: {'planned' if job['plan'] else 'converted'} in {(time.perf_counter() - started) * 1000:.0f} ms")
+    print(f"batch: {len(jobs) - len(failed)} of {len(jobs)} workspaces converted")
+    return failed
+
+
+def report_profile(profiler):
+    if args.profile:
+        print(instrumentation)
+    if args.stats_json is not None:
+        with open(args.stats_json, 'w') as writable:
+            dump(instrumentation.to_dict(), writable, indent=4)
+    if profiler is not None:
+        profiler.dump_stats(args.profile_dump)
+    elif args.profile_dump is not None:
+        instrumentation.write_trace(args.profile_dump)
 
 
-def convert_code_to_eclipse(project_path: str, modules: List[str]):
-    projects = list(map(lambda x: Project(project_path, x), modules))
-    project_bundles = list(
-        map(lambda x: Bundle(args.p2, x.module_root, x), projects))
-    for i in project_bundles:
-        i.clean_classpath()
+def run():
+    if args.batch is not None:
+        failed = run_batch(args.batch)
+        report_profile(profiler)
+        if len(failed) != 0:
+            sys.exit(1)
+    elif (to_code):
+        resolver = convert_eclipse_to_code(
+            eclipse_project_path, submodules_relative_paths, cache_folder, clean_cache, jobs=args.jobs,
+            incremental=args.incremental, p2=args.p2, classpath_jar=args.classpath_jar, prune=args.prune,
+            plan=args.plan, graph_file=args.graph)
+        report_profile(profiler)
+        if args.watch and not args.plan:
+            watch_eclipse_to_code(eclipse_project_path, submodules_relative_paths, cache_folder, resolver, jobs=args.jobs)
+    else:
+        convert_code_to_eclipse(eclipse_project_path, submodules_relative_paths, p2=args.p2, plan=args.plan)
 
 
-if (to_code):
-    convert_eclipse_to_code(
-        eclipse_project_path, submodules_relative_paths, cache_folder, clean_cache)
+if args.shared_index is not None and args.p2 is not None:
+    P2Index.for_repository(args.p2, args.shared_index or None, read_only=args.plan)
+profiler = None
+instrumentation.tracing = args.profile_dump is not None and args.profile_dump.endswith(".json")
+if args.profile_dump is not None and not instrumentation.tracing:
+    # function level profile, e.g. for snakeviz or flameprof
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.runcall(run)
 else:
-    convert_code_to_eclipse(eclipse_project_path, submodules_relative_paths)
+    run()
@@ -0,0 +1,138 @@
+"""Conversion of the submodules of an Eclipse workspace to code and back, without the command line around it.
+classpath_installer.py and the asyncio API in async_api.py both drive the steps of WorkspaceConversion.
+"""
+from pathlib import Path
+from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from dependency import *
+
+
+class WorkspaceConversion:
+    '''Steps of converting the submodules of one workspace to code. Each step is blocking and may run
+    on a worker thread, but the steps of one conversion must run one after another
+    '''
+    def __init__(self, project_path: str, modules: List[str], p2: str, cache_folder: str, clean_cache=False, jobs=1,
+                 incremental=False, resolver: DependencyResolver = None, classpath_jar=False, prune=False, plan=False):
+        self.project_path = project_path
+        self.p2 = p2
+        self.cache_folder = cache_folder
+        self.clean_cache = clean_cache
+        self.jobs = jobs
+        self.incremental = incremental
+        self.classpath_jar = classpath_jar
+        self.prune = prune
+        self.plan = plan
+        projects = list(map(lambda x: Project(project_path, x), modules))
+        self.project_bundles = list(map(lambda x: Bundle(p2, x.module_root, x, cache_folder), projects))
+        # one resolver for all submodules: bundles they share are parsed once
+        self.resolver = resolver if resolver is not None else DependencyResolver(p2, cache_folder, jobs=jobs)
+        # (bundle, resolution), the resolution is None when the classpath is up to date
+        self.resolved = []
+
+    def prepare(self):
+        if not self.plan:
+            configure_vs_code_settings(Path(self.project_path))
+        if self.prune:
+            for bundle in self.project_bundles:
+                bundle.scan_used_packages()
+
+    def read_manifests(self):
+        with instrumentation.phase("read submodule manifests"):
+            for i in self.project_bundles:
+                i.update_dependencies()
+                report(i)
+
+    def prefetch(self):
+        # submodules overlap heavily, so the union of their requirements is loaded in one pass
+        self.resolver.prefetch_dependencies(
+            flat_map(lambda x: x.pending_requirements(self.clean_cache, self.incremental), self.project_bundles))
+
+    def resolve(self):
+        # closures are memoized by the resolver, computing them once everything is loaded is cheap
+        with instrumentation.phase("resolve classpaths"):
+            self.resolved = list(map(lambda x: (x, x.resolve_classpath(
+                clean_cache=self.clean_cache, resolver=self.resolver, incremental=self.incremental,
+                dry_run=self.plan, classpath_jar=self.classpath_jar)), self.project_bundles))
+        return self.resolved
+
+    def write_graph(self, graph_file: str):
+        resolutions = dict(map(lambda x: (x[0].name, x[1]), filter(lambda x: x[1] is not None, self.resolved)))
+        write_graph(graph_file, self.resolver.export_graph(self.project_bundles, resolutions))
+        report(f"dependency graph written to {graph_file}")
+
+    def write_module(self, bundle: Bundle, resolved):
+        # merge classpath files of each submodule
+        bundle.write_classpath(resolved, self.classpath_jar)
+        # need to add magic line if there is no such - makes some red highlight go away
+        bundle.add_magic_line_to_settings()
+
+    def write(self):
+        # files of different submodules are independent
+        with instrumentation.phase("write classpaths"), ThreadPoolExecutor(max_workers=max(self.jobs, 1)) as executor:
+            list(executor.map(lambda x: self.write_module(x[0], x[1]), self.resolved))
+
+    def save(self):
+        with instrumentation.phase("save jar metadata"):
+            JarMetadataStore.save_shared()
+            P2Index.save_shared()
+        for key, value in self.resolver.stats().items():
+            instrumentation.set_counter(f"graph {key}", value)
+        report(f"resolver: {self.resolver}")
+        report(f"jar metadata: {metadata_store_of(self.p2, self.cache_folder)}")
+        for cycle in self.resolver.cycles:
+            report(f"reexport cycle: {' <-> '.join(cycle)}")
+
+
+def convert_eclipse_to_code(project_path1, modules: List[str], cache_folder: str, clean_cache=False, jobs=1, incremental=False,
+                            resolver: DependencyResolver = None, p2: str = None, classpath_jar=False, prune=False,
+                            plan=False, graph_file: str = None):
+    conversion = WorkspaceConversion(project_path1, modules, p2, cache_folder, clean_cache, jobs, incremental, resolver,
+                                     classpath_jar, prune, plan)
+    conversion.prepare()
+    conversion.read_manifests()
+    conversion.prefetch()
+    conversion.resolve()
+    if graph_file is not None:
+        conversion.write_graph(graph_file)
+    if plan:
+        print_plan(conversion.resolved, classpath_jar)
+        report(f"resolver: {conversion.resolver}")
+        return conversion.resolver
+    conversion.write()
+    conversion.save()
+    return conversion.resolver
+
+
+def print_plan(resolved, classpath_jar=False):
+    for bundle, resolution in resolved:
+        added, removed = bundle.plan_classpath(resolution, classpath_jar)
+        classpath_file = bundle.proj.get_classpath_file()
+        if len(added) == 0 and len(removed) == 0:
+            report(f"{classpath_file}: unchanged")
+            continue
+        report(f"{classpath_file}: {len(added)} entries to add, {len(removed)} to remove")
+        for line in added:
+            report(f"+ {line.strip()}")
+        for line in removed:
+            report(f"- {line.strip()}")
+
+
+def print_clean_plan(bundle: Bundle):
+    classpath_file = bundle.proj.get_classpath_file()
+    classpath = ClasspathFile.read(classpath_file)
+    if not classpath.merged:
+        report(f"{classpath_file}: unchanged")
+        return
+    report(f"{classpath_file}: 0 entries to add, {len(classpath.generated)} to remove")
+    for line in classpath.generated:
+        report(f"- {line.strip()}")
+
+
+def convert_code_to_eclipse(project_path: str, modules: List[str], p2: str = None, plan=False):
+    projects = list(map(lambda x: Project(project_path, x), modules))
+    project_bundles = list(map(lambda x: Bundle(p2, x.module_root, x), projects))
+    for i in project_bundles:
+        if plan:
+            print_clean_plan(i)
+        else:
+            i.clean_classpath()
@@ -1,23 +1,53 @@
 
 from pathlib import Path
 from typing import List, Set
+from functools import total_ordering
+from array import array
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
 import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import re
 import json
+import sqlite3
 from json import dump, load, loads, JSONDecodeError
+from urllib.parse import quote
+# names and the closure cache fingerprint shared with the warm start check
+from fast_path import manifest_path, classpath_file_subpath, settings_file_subpath, settings_magic_line, \
+    classpath_autogen_marker, classpath_end_tag, plugins_subpath, closure_cache_format, vscode_settings_folder, \
+    vscode_settings_subpath, vscode_settings, pool_listing_digest, file_digest
 
-manifest_path = "META-INF/MANIFEST.MF"
 p2_info_path = "META-INF/p2.inf"
 dependency_declaration_keyword = "Require-Bundle"
-dependency_declaration_word_end = ":"
-classpath_file_subpath = ".classpath"
-settings_file_subpath = ".settings/org.eclipse.jdt.core.prefs"
+import_package_keyword = "Import-Package"
+export_package_keyword = "Export-Package"
+fragment_host_keyword = "Fragment-Host"
+symbolic_name_keyword = "Bundle-SymbolicName"
+bundle_version_keyword = "Bundle-Version"
 settings_magic_line_pattern = re.compile(r".*org\.eclipse\.jdt\.core\.compiler\.problem\.forbiddenReference[\s]*=[\s]*ignore.*")
-settings_magic_line = "org.eclipse.jdt.core.compiler.problem.forbiddenReference=ignore"
-classpath_autogen_line_pattern = re.compile(r".*<!-- BELOW AUTO GEN -->.*")
-vscode_settings_folder = ".vscode/"
-vscode_settings_subpath = ".vscode/settings.json"
-vscode_settings = { "java.import.maven.enabled": False, "java.autobuild.enabled": False}
+source_bundle_suffix = ".source"
+# name_version.jar, where the version is major[.minor[.micro]][.qualifier] and the qualifier may contain '_'
+plugin_jar_pattern = re.compile(r"(?P<name>.+?)_(?P<version>\d+(?:\.\d+){0,2}(?:\.[\w-]+)?)\.jar")
+jar_metadata_file_name = "jar_metadata.etvsc.json"
+p2_index_file_name = "p2_index.etvsc.sqlite"
+classpath_jar_suffix = ".classpath.jar"
+java_source_suffixes = (".java", ".xtend")
+# the import section of a source file ends where the first type is declared
+java_declaration_starts = ("public ", "protected ", "private ", "abstract ", "final ", "sealed ", "class ", "interface ",
+                           "enum ", "record ", "@")
+classpath_entry_kind_pattern = re.compile(r'\bkind="([^"]*)"')
+classpath_entry_path_pattern = re.compile(r'\bpath="([^"]*)"')
+jar_metadata_format = 5
+# manifest header values are split on ',' (clauses) and ';' (parameters) that are not inside quotes
+clause_split_pattern = re.compile(r'(?:[^,"]|"[^"]*")+')
+parameter_split_pattern = re.compile(r'(?:[^;"]|"[^"]*")+')
 
 def flat_map(f, xs):
     ys = []
@@ -25,6 +55,23 @@ def flat_map(f, xs):
         ys.extend(f(x))
     return ys
 
+def unique(xs):
+    # keeps the first occurrence, items may be unhashable lists
+    seen = set()
+    ys = []
+    for x in xs:
+        key = x if isinstance(x, str) else tuple(x)
+        if key not in seen:
+            seen.add(key)
+            ys.append(x)
+    return ys
+
+def requirement_key(dependency: "Dependency") -> str:
+    return f"{dependency.name};{dependency.version_range}"
+
+def package_requirement_key(package: "PackageImport") -> str:
+    return f"package {package.name};{package.version_range}"
+
 def pretty_print_header(adict, lengths=False):
     for key, value in adict.items():
         print(key, end='\t')
@@ -49,24 +96,250 @@ def pretty_print(arr):
         else:
             print(",")
 
+class Instrumentation:
+    '''Wall time of the phases of a conversion and counters of the work done in them.
+    When tracing, every phase is also kept as a trace event (chrome://tracing, Perfetto, speedscope)
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.counters = {}
+        self.events = []
+        self.tracing = False
+
+    def count(self, name: str, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_counter(self, name: str, value):
+        with self.lock:
+            self.counters[name] = value
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            ended = time.perf_counter()
+            with self.lock:
+                total, calls = self.phases.get(name, (0.0, 0))
+                self.phases[name] = (total + ended - started, calls + 1)
+                if self.tracing:
+                    self.events.append({"name": name, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                                        "ts": (started - self.started) * 1e6, "dur": (ended - started) * 1e6})
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "phases": dict(map(lambda x: (x[0], {"seconds": x[1][0], "calls": x[1][1]}), self.phases.items())),
+                "counters": dict(self.counters),
+            }
+
+    def write_trace(self, file: Path):
+        with self.lock:
+            events = list(self.events)
+        with Path(file).open('w') as writable:
+            dump({"traceEvents": events, "displayTimeUnit": "ms"}, writable)
+
+    def __str__(self):
+        stats = self.to_dict()
+        lines = list(map(lambda x: f"{x[0]}: {x[1]['seconds'] * 1000:.1f} ms in {x[1]['calls']} calls",
+                         stats["phases"].items()))
+        lines.extend(map(lambda x: f"{x[0]}: {x[1]}", sorted(stats["counters"].items())))
+        return "\n".join(lines)
+
+
+# shared by everything that runs in the process, like the catalogs and stores
+instrumentation = Instrumentation()
+
+
+class Reporter:
+    '''Messages of the conversion, printed unless a listener takes them: stdout of a process embedding
+    the converter may be its protocol stream, the asyncio API turns them into progress events
+    '''
+    def __init__(self):
+        self.listener = None
+
+    def __call__(self, *values):
+        text = " ".join(map(lambda x: str(x), values))
+        listener = self.listener
+        if listener is None:
+            print(text)
+        else:
+            listener(text)
+
+
+report = Reporter()
+
+@total_ordering
+class OsgiVersion:
+    '''major.minor.micro.qualifier, missing numbers are 0 and the qualifier is compared as a string
+    '''
+    __slots__ = ("text", "key")
+    _parsed = {}
+
+    @classmethod
+    def of(cls, text: str) -> "OsgiVersion":
+        '''Shared instance for the text, pools repeat the same versions over and over
+        '''
+        version = cls._parsed.get(text)
+        if version is None:
+            version = cls(text)
+            cls._parsed[text] = version
+        return version
+
+    def __init__(self, text: str):
+        self.text = text.strip()
+        parts = self.text.split('.', 3)
+        numbers = []
+        qualifier = parts[3] if len(parts) > 3 else ""
+        for index, part in enumerate(parts[:3]):
+            digits = len(part) - len(part.lstrip("0123456789"))
+            if digits == len(part) or digits == 0:
+                numbers.append(int(part))
+                continue
+            # jars built outside of p2 like 1.0.0-SNAPSHOT or 1.6.0_v1: the rest of the number is the qualifier
+            numbers.append(int(part[:digits]))
+            qualifier = ".".join([part[digits:]] + parts[index + 1:])
+            break
+        numbers.extend([0] * (3 - len(numbers)))
+        self.key = (numbers[0], numbers[1], numbers[2], qualifier)
+
+    def __eq__(self, o: object) -> bool:
+        return isinstance(o, OsgiVersion) and self.key == o.key
+
+    def __lt__(self, o: "OsgiVersion") -> bool:
+        return self.key < o.key
+
+    def __hash__(self) -> int:
+        return hash(self.key)
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return self.text
+
+
+class VersionRange:
+    '''OSGi version range: "[1.0,2.0)" style intervals, a bare version means "at least",
+    no version (or an unresolved p2 placeholder like $version$) means any version
+    '''
+    __slots__ = ("minimum", "include_minimum", "maximum", "include_maximum")
+    _parsed = {}
+
+    def __init__(self, minimum: OsgiVersion = None, include_minimum=True, maximum: OsgiVersion = None, include_maximum=False):
+        self.minimum = minimum
+        self.include_minimum = include_minimum
+        self.maximum = maximum
+        self.include_maximum = include_maximum
+
+    @classmethod
+    def parse(cls, text: str):
+        '''Ranges are never changed after parsing, so equal texts share one instance
+        '''
+        version_range = cls._parsed.get(text)
+        if version_range is None:
+            version_range = cls.parse_new(text)
+            cls._parsed[text] = version_range
+        return version_range
+
+    @classmethod
+    def parse_new(cls, text: str):
+        if text is None:
+            return any_version_range
+        text = text.strip().strip('"').strip()
+        if len(text) == 0 or '$' in text:
+            return any_version_range
+        try:
+            if text[0] in '[(' and text[-1] in '])':
+                lower, upper = text[1:-1].split(',')
+                return cls(OsgiVersion.of(lower.strip()), text[0] == '[', OsgiVersion.of(upper.strip()), text[-1] == ']')
+            return cls(OsgiVersion.of(text))
+        except ValueError:
+            report(f"could not parse version range {text}, any version will be used")
+            return any_version_range
+
+    def is_any(self):
+        return self.minimum is None and self.maximum is None
+
+    def includes(self, version: OsgiVersion) -> bool:
+        if self.minimum is not None:
+            if version < self.minimum or (version == self.minimum and not self.include_minimum):
+                return False
+        if self.maximum is not None:
+            if version > self.maximum or (version == self.maximum and not self.include_maximum):
+                return False
+        return True
+
+    def __str__(self):
+        if self.is_any():
+            return ""
+        if self.maximum is None:
+            return str(self.minimum)
+        opening = '[' if self.include_minimum else '('
+        closing = ']' if self.include_maximum else ')'
+        return f"{opening}{self.minimum},{self.maximum}{closing}"
+
+
+any_version_range = VersionRange()
+
+
 class Dependency:
-    def __init__(self, dependency_manifest_string, is_p2_required_line=False):
-        params = dependency_manifest_string.split(';')
-        self.name = params[0].strip()
-        self.exported = dependency_manifest_string.find(
-            "reexport") > 0 or is_p2_required_line
+    __slots__ = ("name", "exported", "version_range")
+
+    def __init__(self, name: str, exported=False, version_range: VersionRange = None):
+        self.name = sys.intern(name)
+        self.exported = exported
+        self.version_range = version_range if version_range is not None else any_version_range
+
+    @classmethod
+    def from_clause(cls, clause: "ManifestClause", name: str = None):
+        return cls(
+            clause.names[0] if name is None else name,
+            clause.directives.get("visibility") == "reexport",
+            VersionRange.parse(clause.attributes.get("bundle-version")))
 
     @classmethod
-    def from_file_string(cls, file_string: str):
-        cls.name = file_string
-        # True because cached dependency means its exported
-        cls.exported = True
+    def from_manifest_string(cls, dependency_manifest_string: str):
+        return cls.from_clause(parse_clauses(dependency_manifest_string)[0])
 
     def to_bundle(self, p2_rep: Path):
         return Bundle(p2_rep, self.name)
 
+    def to_record(self):
+        return [self.name, self.exported, str(self.version_range)]
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(record[0], record[1], VersionRange.parse(record[2]))
+
+    def __str__(self):
+        return f"{self.name} {self.version_range} : exported {int(self.exported)}"
+
+    def __repr__(self):
+        return f"{self.name}"
+
+
+class PackageImport:
+    '''One package of an Import-Package header
+    '''
+    __slots__ = ("name", "version_range", "optional")
+
+    def __init__(self, name: str, version_range: VersionRange = None, optional=False):
+        self.name = sys.intern(name)
+        self.version_range = version_range if version_range is not None else any_version_range
+        self.optional = optional
+
+    @classmethod
+    def from_clause(cls, clause: "ManifestClause", name: str):
+        return cls(name, VersionRange.parse(clause.attributes.get("version")),
+                   clause.directives.get("resolution") == "optional")
+
     def __str__(self):
-        return f"{self.name} : exported {int(self.exported)}"
+        return f"{self.name} {self.version_range}"
 
     def __repr__(self):
         return f"{self.name}"
@@ -81,28 +354,622 @@ class Project():
     def list_root(self):
         return Path(self.root).iterdir()
 
+    def workspace(self) -> "WorkspaceIndex":
+        return WorkspaceIndex.for_root(self.root)
+
     def is_in_root(self, name):
-        pattern = r".*({}).*".format(name)
-        found = list(filter(lambda x: re.fullmatch(
-            pattern, x.stem + x.suffix), self.list_root()))
-        return len(found) > 0
+        return self.workspace().project_folder(name) is not None
 
     def get_classpath_file(self):
         return self.module_path().joinpath(classpath_file_subpath)
 
 
-class Bundle:
-    def __init__(self, p2_rep: str, name: str, proj: Project = None, cache_folder: str = None):
-        self.p2_rep = Path(p2_rep)
+class WorkspaceIndex:
+    '''Projects of a workspace root by the Bundle-SymbolicName of their MANIFEST.MF.
+    The root is listed once, after that every sibling check is a dict access.
+    Use for_root to get the index shared by all projects of the same root.
+    '''
+    _shared = {}
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.projects = {}
+        self.folders = set()
+        # exported package -> folder of the project
+        self.packages = {}
+        self.built = False
+
+    @classmethod
+    def for_root(cls, root):
+        key = os.path.abspath(os.path.expanduser(str(root)))
+        index = cls._shared.get(key)
+        if index is None:
+            index = cls(root)
+            cls._shared[key] = index
+        return index
+
+    def build(self):
+        projects = {}
+        folders = set()
+        packages = {}
+        if self.root.is_dir():
+            with os.scandir(self.root) as listing:
+                for item in listing:
+                    if not item.is_dir():
+                        continue
+                    folders.add(item.name)
+                    manifest = Path(item.path).joinpath(manifest_path)
+                    if not manifest.is_file():
+                        continue
+                    with manifest.open('r', errors='replace') as opened_file:
+                        bundle_manifest = BundleManifest.parse(opened_file)
+                    name = bundle_manifest.symbolic_name()
+                    if name is not None:
+                        projects[name] = item.name
+                    for package, _ in bundle_manifest.package_exports():
+                        packages[package] = item.name
+        self.projects = projects
+        self.folders = folders
+        self.packages = packages
+        self.built = True
+
+    def build_if_must(self):
+        if not self.built:
+            self.build()
+
+    def project_folder(self, name: str):
+        '''Folder of the sibling project with the given symbolic name, folders without
+        a manifest are matched by their name
+        '''
+        self.build_if_must()
+        folder = self.projects.get(name)
+        if folder is None and name in self.folders:
+            folder = name
+        return folder
+
+    def package_folder(self, package: str):
+        '''Folder of the sibling project that exports the given package
+        '''
+        self.build_if_must()
+        return self.packages.get(package)
+
+
+class CatalogEntry:
+    '''All jars of one bundle symbolic name found in the p2 pool, by version
+    '''
+    __slots__ = ("name", "binaries", "sources")
+
+    def __init__(self, name: str):
         self.name = name
+        self.binaries = {}
+        self.sources = {}
+
+    def versions(self):
+        return sorted(set(self.binaries.keys()).union(self.sources.keys()), key=lambda x: OsgiVersion.of(x))
+
+    def binary_versions(self):
+        return sorted(self.binaries.keys(), key=lambda x: OsgiVersion.of(x))
+
+    def binary_jars(self):
+        return list(map(lambda x: self.binaries[x], sorted(self.binaries.keys(), key=lambda x: OsgiVersion.of(x))))
+
+    def best_version(self, version_range: VersionRange = None):
+        '''Highest version that matches the range, bundles with a binary jar are preferred
+        '''
+        candidates = self.versions()
+        with_binaries = list(filter(lambda x: x in self.binaries, candidates))
+        if len(with_binaries) != 0:
+            candidates = with_binaries
+        if version_range is not None:
+            candidates = list(filter(lambda x: version_range.includes(OsgiVersion.of(x)), candidates))
+        if len(candidates) == 0:
+            return None
+        return candidates[-1]
+
+    def source_of(self, version: str):
+        return self.sources.get(version)
+
+    def jars_of_version(self, version: str):
+        jars = []
+        if version in self.binaries:
+            jars.append(self.binaries[version])
+        if version in self.sources:
+            jars.append(self.sources[version])
+        return jars
+
+    def jars(self):
+        return flat_map(lambda x: self.jars_of_version(x), self.versions())
+
+
+class P2Catalog:
+    '''Index of the pool/plugins folder of a p2 repository.
+    The folder is listed once, after that every lookup by bundle name is a dict access.
+    Use for_repository to get the catalog shared by all bundles of the same repository.
+    '''
+    _shared = {}
+
+    def __init__(self, p2_rep: str):
+        self.p2_rep = Path(p2_rep)
+        self.entries = {}
+        self.selections = {}
+        self.listing_digest = None
+        self.scanned = False
+
+    @classmethod
+    def for_repository(cls, p2_rep):
+        key = os.path.abspath(os.path.expanduser(str(p2_rep)))
+        catalog = cls._shared.get(key)
+        if catalog is None:
+            catalog = cls(p2_rep)
+            cls._shared[key] = catalog
+        return catalog
+
+    def plugins_path(self):
+        return self.p2_rep.joinpath(plugins_subpath)
+
+    def scan(self):
+        with instrumentation.phase("scan pool"):
+            self.scan_plugins()
+
+    def scan_plugins(self):
+        instrumentation.count("pool scans")
+        entries = {}
+        jar_names = []
+        plugins = self.plugins_path()
+        if plugins.is_dir():
+            with os.scandir(plugins) as listing:
+                for item in listing:
+                    if item.name.endswith(".jar"):
+                        jar_names.append(item.name)
+                    match = plugin_jar_pattern.fullmatch(item.name)
+                    if match is None or not item.is_file():
+                        continue
+                    name = match.group("name")
+                    version = sys.intern(match.group("version"))
+                    try:
+                        OsgiVersion.of(version)
+                    except ValueError:
+                        report(f"{item.name}: version {version} is not an OSGi version, the jar is skipped")
+                        continue
+                    is_source = name.endswith(source_bundle_suffix)
+                    if is_source:
+                        name = name[:-len(source_bundle_suffix)]
+                    name = sys.intern(name)
+                    entry = entries.get(name)
+                    if entry is None:
+                        entry = CatalogEntry(name)
+                        entries[name] = entry
+                    if is_source:
+                        entry.sources[version] = item.name
+                    else:
+                        entry.binaries[version] = item.name
+        self.entries = entries
+        self.selections = {}
+        self.listing_digest = pool_listing_digest(jar_names)
+        self.scanned = True
+
+    def scan_if_must(self):
+        if not self.scanned:
+            self.scan()
+
+    def entry(self, name: str):
+        self.scan_if_must()
+        return self.entries.get(name)
+
+    def get_listing_digest(self):
+        self.scan_if_must()
+        return self.listing_digest
+
+    def jars_of(self, name: str, version: str = None):
+        entry = self.entry(name)
+        if entry is None:
+            return []
+        if version is None:
+            return entry.jars()
+        return entry.jars_of_version(version)
+
+    def select_version(self, name: str, version_range: VersionRange = None):
+        '''Best version of the bundle for the range. When the pool has no version in the range
+        the highest one is used, it is usually still compatible enough for code navigation
+        '''
+        selection_key = (name, str(version_range) if version_range is not None else "")
+        if selection_key in self.selections:
+            return self.selections[selection_key]
+        entry = self.entry(name)
+        version = None
+        if entry is not None:
+            version = entry.best_version(version_range)
+            if version is None:
+                version = entry.best_version()
+                report(f"no version of {name} matches {version_range}, using {version}")
+        self.selections[selection_key] = version
+        return version
+
+    def __len__(self):
+        self.scan_if_must()
+        return len(self.entries)
+
+
+class JarReader:
+    '''Reads a few entries of a jar in one pass over its central directory.
+    Unlike zipfile.ZipFile no index of all the entries is built, which matters for jars with thousands
+    of classes. Zip64 archives and other unusual layouts are handed over to zipfile.
+    Must be used as a context manager, the file is closed on exit.
+    '''
+    end_record_signature = b"PK\x05\x06"
+    end_record = struct.Struct("<4s4H2LH")
+    central_record_signature = b"PK\x01\x02"
+    central_record = struct.Struct("<4s6H3L5H2L")
+    local_record_signature = b"PK\x03\x04"
+    local_record = struct.Struct("<4s5H3L2H")
+    # the end record is followed by a comment of at most 65535 bytes
+    end_search_size = 22 + 65535
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.file = None
+        self.data = None
+
+    def __enter__(self):
+        instrumentation.count("jars opened")
+        self.file = open(self.path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        # an empty file can not be mapped
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+        self.data = None
+        self.file = None
+        return False
+
+    def read_entries(self, names) -> dict:
+        '''Returns a dict entry name -> bytes for the given entries that exist in the jar
+        '''
+        try:
+            return self.read_entries_from_directory(set(names))
+        except (struct.error, zlib.error, ValueError, NotImplementedError):
+            return self.read_entries_with_zipfile(names)
+
+    def read_entries_from_directory(self, names) -> dict:
+        data = self.data
+        end_offset = data.rfind(self.end_record_signature, max(0, len(data) - self.end_search_size))
+        if end_offset < 0:
+            raise ValueError(f"{self.path} is not a zip file")
+        _, disk, _, _, entries_count, directory_size, directory_offset, _ = self.end_record.unpack_from(data, end_offset)
+        if disk != 0 or entries_count == 0xFFFF or directory_offset == 0xFFFFFFFF:
+            raise NotImplementedError("zip64 or multi disk archive")
+        directory_end = directory_offset + directory_size
+        found = {}
+        for name in names:
+            record = self.find_central_record(name.encode('utf8'), directory_offset, directory_end)
+            if record is not None:
+                found[name] = self.read_local_entry(record[16], record[4], record[8])
+        return found
+
+    def find_central_record(self, name: bytes, start, end):
+        # searching the name bytes is much faster than unpacking every record of a big jar
+        data = self.data
+        position = data.find(name, start, end)
+        while position >= 0:
+            record_offset = position - self.central_record.size
+            if record_offset >= start:
+                record = self.central_record.unpack_from(data, record_offset)
+                if record[0] == self.central_record_signature and record[10] == len(name):
+                    return record
+            position = data.find(name, position + 1, end)
+        return None
+
+    def read_local_entry(self, offset, method, compressed_size) -> bytes:
+        record = self.local_record.unpack_from(self.data, offset)
+        if record[0] != self.local_record_signature:
+            raise ValueError(f"broken local header in {self.path}")
+        start = offset + self.local_record.size + record[9] + record[10]
+        raw = self.data[start:start + compressed_size]
+        if method == zipfile.ZIP_STORED:
+            return bytes(raw)
+        if method == zipfile.ZIP_DEFLATED:
+            return zlib.decompress(raw, -zlib.MAX_WBITS)
+        raise NotImplementedError(f"compression method {method}")
+
+    def read_entries_with_zipfile(self, names) -> dict:
+        found = {}
+        with zipfile.ZipFile(self.path) as archive:
+            for name in names:
+                try:
+                    found[name] = archive.read(name)
+                except KeyError:
+                    pass
+        return found
+
+
+def entry_lines(content: bytes):
+    if content is None:
+        return []
+    return content.decode('utf8', errors='replace').splitlines()
+
+
+def read_jar_metadata_lines(jar: Path):
+    '''Returns lines of MANIFEST.MF and p2.inf of the jar, opening it once
+    '''
+    with instrumentation.phase("read jars"), JarReader(jar) as reader:
+        entries = reader.read_entries([manifest_path, p2_info_path])
+    return entry_lines(entries.get(manifest_path)), entry_lines(entries.get(p2_info_path))
+
+
+class JarMetadataStore:
+    '''Persistent store of dependencies parsed from p2 jars, kept in the cache folder.
+    A record is valid while the jar keeps its size and modification time, so jars of the
+    pool are opened only when they are new or changed.
+    Use for_folder to get the store shared by all bundles of the same cache folder.
+    '''
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, cache_folder: str):
+        self.file = Path(cache_folder).joinpath(jar_metadata_file_name)
+        self.records = {}
+        self.loaded = False
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        # bundles may be parsed by the workers of DependencyResolver.prefetch
+        self.lock = threading.RLock()
+
+    @classmethod
+    def for_folder(cls, cache_folder):
+        key = os.path.abspath(os.path.expanduser(str(cache_folder)))
+        with cls._shared_lock:
+            store = cls._shared.get(key)
+            if store is None:
+                store = cls(cache_folder)
+                cls._shared[key] = store
+        return store
+
+    @classmethod
+    def save_shared(cls):
+        for store in cls._shared.values():
+            store.save()
+
+    def load(self):
+        self.loaded = True
+        if not self.file.is_file():
+            return
+        try:
+            with self.file.open('r') as opened_file:
+                content = load(opened_file)
+        except (JSONDecodeError, OSError):
+            report("jar metadata store is corrupted, it will be rebuilt")
+            return
+        if content.get("format") != jar_metadata_format:
+            return
+        self.records = content.get("jars", {})
+
+    def load_if_must(self):
+        with self.lock:
+            if not self.loaded:
+                self.load()
+
+    @staticmethod
+    def key_of(jar: Path):
+        # absolute: the store is shared by runs started from other folders and with other forms of -p2
+        stat = os.stat(jar)
+        return os.path.abspath(jar), stat.st_size, stat.st_mtime_ns
+
+    def get(self, jar: Path):
+        '''Dependencies and exported packages parsed from the jar before, None if it was not parsed or has changed
+        '''
+        self.load_if_must()
+        path, size, mtime = self.key_of(jar)
+        with self.lock:
+            record = self.records.get(path)
+            if record is None or record["size"] != size or record["mtime"] != mtime:
+                self.misses += 1
+                instrumentation.count("jar metadata misses")
+                return None
+            self.hits += 1
+        instrumentation.count("jar metadata hits")
+        return list(map(lambda x: Dependency.from_record(x), record["dependencies"])), record["exports"]
+
+    def put(self, jar: Path, dependencies: List[Dependency], exports: List[list] = []):
+        self.load_if_must()
+        path, size, mtime = self.key_of(jar)
+        record = {
+            "size": size,
+            "mtime": mtime,
+            "dependencies": list(map(lambda x: x.to_record(), dependencies)),
+            "exports": exports,
+        }
+        with self.lock:
+            self.records[path] = record
+            self.dirty = True
+
+    def save(self):
+        with self.lock:
+            self.save_locked()
+
+    def save_locked(self):
+        if not self.dirty:
+            return
+        # forget jars that were removed from the pool
+        self.records = dict(filter(lambda x: os.path.exists(x[0]), self.records.items()))
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = self.file.with_name(self.file.name + ".tmp")
+        with temp_file.open('w') as writable:
+            dump({"format": jar_metadata_format, "jars": self.records}, writable)
+        os.replace(temp_file, self.file)
+        self.dirty = False
+
+    def __str__(self):
+        return f"{len(self.records)} jars | {self.hits} hits | {self.misses} misses"
+
+
+class P2Index(JarMetadataStore):
+    '''Jar metadata and resolved closures of requirements shared by every workspace converted against a p2 pool,
+    kept in an SQLite database next to the pool or in a given folder.
+    SQLite locks the file, so conversions running at the same time only add their rows to it.
+    Use for_repository to enable the index of a repository, after that bundles of the repository use it
+    instead of the jar metadata store of their cache folder.
+    '''
+    _shared = {}
+    _repositories = {}
+
+    def __init__(self, index_folder: str):
+        super().__init__(index_folder)
+        self.file = Path(index_folder).joinpath(p2_index_file_name)
+        self.connection = None
+        self.changed = set()
+        self.closures = {}
+        self.closure_hits = 0
+        # a dry run only reads the index, it is neither created nor changed
+        self.read_only = False
+
+    @classmethod
+    def for_repository(cls, p2_rep, index_folder: str = None, read_only=False):
+        '''Returns None for a read only index that does not exist yet
+        '''
+        index = cls.for_folder(index_folder if index_folder is not None else p2_rep)
+        if read_only:
+            if not index.file.is_file():
+                return None
+            index.read_only = True
+        with cls._shared_lock:
+            cls._repositories[os.path.abspath(os.path.expanduser(str(p2_rep)))] = index
+        return index
+
+    @classmethod
+    def of_repository(cls, p2_rep):
+        return cls._repositories.get(os.path.abspath(os.path.expanduser(str(p2_rep))))
+
+    def connect(self):
+        if self.connection is None and self.read_only:
+            self.connection = sqlite3.connect(f"{self.file.absolute().as_uri()}?mode=ro", uri=True, timeout=60,
+                                              check_same_thread=False)
+        if self.connection is None:
+            self.file.parent.mkdir(parents=True, exist_ok=True)
+            # calls are serialized by self.lock, the workers of prefetch may save
+            self.connection = sqlite3.connect(str(self.file), timeout=60, check_same_thread=False)
+            try:
+                # readers are not blocked by a conversion that is writing
+                self.connection.execute("PRAGMA journal_mode=WAL")
+            except sqlite3.DatabaseError:
+                pass
+            with self.connection:
+                self.connection.execute("CREATE TABLE IF NOT EXISTS jar_metadata (path TEXT PRIMARY KEY, size INTEGER, "
+                                        "mtime INTEGER, format INTEGER, metadata TEXT)")
+                self.connection.execute("CREATE TABLE IF NOT EXISTS closures (p2 TEXT, pool TEXT, requirement TEXT, "
+                                        "format INTEGER, record TEXT, PRIMARY KEY (p2, pool, requirement))")
+        return self.connection
+
+    def load(self):
+        self.loaded = True
+        try:
+            rows = self.connect().execute("SELECT path, size, mtime, metadata FROM jar_metadata WHERE format = ?",
+                                          (jar_metadata_format,)).fetchall()
+        except sqlite3.DatabaseError as error:
+            report(f"p2 index {self.file} can not be read: {error}")
+            return
+        self.records = dict(map(lambda x: (x[0], dict(loads(x[3]), size=x[1], mtime=x[2])), rows))
+
+    def put(self, jar: Path, dependencies: List[Dependency], exports: List[list] = []):
+        super().put(jar, dependencies, exports)
+        with self.lock:
+            self.changed.add(os.path.abspath(jar))
+
+    def get_closures(self, p2_rep, pool_digest: str, keys: List[str]) -> dict:
+        '''Resolved closures of the given requirement keys that are known for this state of the pool
+        '''
+        p2 = os.path.abspath(str(p2_rep))
+        found = {}
+        with self.lock:
+            pending = self.closures.get((p2, pool_digest), {})
+            found.update(filter(lambda x: x[0] in pending, map(lambda x: (x, pending.get(x)), keys)))
+            missing = list(filter(lambda x: x not in found, keys))
+            # sqlite limits the number of parameters of a query
+            for start in range(0, len(missing), 500):
+                chunk = missing[start:start + 500]
+                try:
+                    rows = self.connect().execute(
+                        "SELECT requirement, record FROM closures WHERE p2 = ? AND pool = ? AND format = ? "
+                        f"AND requirement IN ({','.join('?' * len(chunk))})",
+                        [p2, pool_digest, closure_cache_format] + chunk).fetchall()
+                except sqlite3.DatabaseError as error:
+                    report(f"p2 index {self.file} can not be read: {error}")
+                    break
+                found.update(map(lambda x: (x[0], loads(x[1])), rows))
+        return found
+
+    def put_closures(self, p2_rep, pool_digest: str, closures: dict):
+        if len(closures) == 0:
+            return
+        with self.lock:
+            self.closures.setdefault((os.path.abspath(str(p2_rep)), pool_digest), {}).update(closures)
+            self.dirty = True
+
+    def save_locked(self):
+        if not self.dirty or self.read_only:
+            return
+        removed = list(filter(lambda x: not os.path.exists(x), self.records.keys()))
+        for path in removed:
+            del self.records[path]
+        jars = list(map(lambda x: (x, self.records[x]), filter(lambda x: x in self.records, self.changed)))
+        connection = self.connect()
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO jar_metadata VALUES (?, ?, ?, ?, ?)", map(
+                lambda x: (x[0], x[1]["size"], x[1]["mtime"], jar_metadata_format,
+                           json.dumps({"dependencies": x[1]["dependencies"], "exports": x[1]["exports"]})),
+                jars))
+            # forget jars that were removed from the pool
+            connection.executemany("DELETE FROM jar_metadata WHERE path = ?", map(lambda x: (x,), removed))
+            for (p2, pool_digest), closures in self.closures.items():
+                # closures of older states of the pool will not be looked up anymore
+                connection.execute("DELETE FROM closures WHERE p2 = ? AND pool != ?", (p2, pool_digest))
+                connection.executemany("INSERT OR REPLACE INTO closures VALUES (?, ?, ?, ?, ?)", map(
+                    lambda x: (p2, pool_digest, x[0], closure_cache_format, json.dumps(x[1])), closures.items()))
+        self.changed = set()
+        self.closures = {}
+        self.dirty = False
+
+    def __str__(self):
+        return f"{super().__str__()} | {self.closure_hits} closure hits | shared index {self.file}"
+
+
+def metadata_store_of(p2_rep, cache_folder: str = None):
+    '''Shared p2 index of the repository if it is enabled, otherwise the store of the cache folder
+    '''
+    index = P2Index.of_repository(p2_rep)
+    if index is not None:
+        return index
+    if cache_folder is None:
+        return None
+    return JarMetadataStore.for_folder(cache_folder)
+
+
+class Bundle:
+    __slots__ = ("p2_rep", "name", "version", "jars", "proj", "dependencies", "exports", "imports", "cache_folder",
+                 "fresh_cache", "previous_resolution", "used_packages")
+
+    def __init__(self, p2_rep: str, name: str, proj: Project = None, cache_folder: str = None, version: str = None):
+        # the resolver passes one shared Path to all its bundles
+        self.p2_rep = p2_rep if isinstance(p2_rep, Path) else Path(p2_rep)
+        self.name = sys.intern(name)
+        self.version = version
         self.jars = []
         self.proj = proj
-        self.all_pattern = r"({})(\.source)?_[\.a-zA-Z0-9-]+\.jar".format(
-            self.name)
-        self.header_pattern = r"({})_[\.a-zA-Z0-9-]+\.jar".format(self.name)
         self.dependencies = []
+        # [package, version] of Export-Package and the Import-Package clauses
+        self.exports = []
+        self.imports = []
         self.cache_folder = cache_folder
-        # print(self.all_pattern, self.header_pattern)
+        # (loaded, cache) - the closure cache is validated once per bundle
+        self.fresh_cache = (False, None)
+        # packages imported by the sources of the module when the classpath is pruned, None otherwise
+        self.used_packages = None
+        # resolution the classpath was generated from, set when it is patched incrementally
+        self.previous_resolution = None
 
     def is_tycho(self):
         return self.proj is None
@@ -115,40 +982,61 @@ class Bundle:
         return self.cache_folder_path().joinpath(f"{self.name}.etvsc")
 
     def plugins_path(self):
-        return self.p2_rep.joinpath("pool/plugins")
+        return self.p2_rep.joinpath(plugins_subpath)
+
+    def catalog(self) -> P2Catalog:
+        return P2Catalog.for_repository(self.p2_rep)
 
-    def to_file_string(self):
-        return self.name
+    def metadata_store(self):
+        return metadata_store_of(self.p2_rep, self.cache_folder)
+
+    def display_name(self):
+        if self.version is None:
+            return self.name
+        return f"{self.name} {self.version}"
 
     def jars_paths(self):
         plugins = self.plugins_path()
         return list(map(lambda x: plugins.joinpath(x), self.jars))
 
+    def classpath_jars(self):
+        '''Jars to put into the classpath and the source jar attached to each of them.
+        A source jar goes into the classpath only when there is no binary jar of the same version
+        '''
+        entry = self.catalog().entry(self.name) if self.version is not None else None
+        if entry is None:
+            return [], {}
+        # absolute: closures are shared through the p2 index by runs started from other folders
+        plugins = Path(os.path.abspath(self.plugins_path()))
+        binary = entry.binaries.get(self.version)
+        source = entry.source_of(self.version)
+        if binary is None:
+            return ([str(plugins.joinpath(source))] if source is not None else []), {}
+        jar = str(plugins.joinpath(binary))
+        if source is None:
+            return [jar], {}
+        return [jar], {jar: str(plugins.joinpath(source))}
+
     def update_jars(self):
         if self.is_tycho() is False:
-            print("not tycho")
+            report("not tycho")
             return []
-        plugins = self.plugins_path()
-        bundles = plugins.glob("*.jar")
-        bundles = list(bundles)
-        jars = list(filter(lambda x: re.fullmatch(
-            self.all_pattern, x.stem + x.suffix) is not None, bundles))
-        jars = list(map(lambda x: str(x.stem + x.suffix), jars))
-        self.jars = jars
+        catalog = self.catalog()
+        if self.version is None:
+            self.version = catalog.select_version(self.name)
+        self.jars = catalog.jars_of(self.name, self.version) if self.version is not None else []
 
     '''Looks for a jar that is named like the given name in the given p2 repository 
     '''
     def get_jar_with_manifest_for_p2(self):
-        pattern = re.compile(self.header_pattern)
         if self.jars is None or len(self.jars) == 0:
             return None
-        not_source = list(
-            filter(lambda x: re.fullmatch(pattern, x), self.jars))
-        if self.jars is None or len(not_source) == 0:
+        entry = self.catalog().entry(self.name)
+        if entry is None or self.version not in entry.binaries:
             return None
-        manifest = self.plugins_path().joinpath(not_source[0])
+        manifest = self.plugins_path().joinpath(entry.binaries[self.version])
         if not manifest.exists():
-            print("could not update dependencies: manifest path doesn't exist")
+            report("could not update dependencies: manifest path doesn't exist")
             return None
         return manifest
 
@@ -157,60 +1045,83 @@ class Bundle:
         path = self.proj.module_path()
         manifest = path.joinpath(manifest_path)
         if not manifest.exists():
-            print("could not get manifest file for Eclipse project")
+            report("could not get manifest file for Eclipse project")
             return None
         return manifest
 
+    def get_jar_metadata_lines(self):
+        file = self.get_jar_with_manifest_for_p2()
+        if file is None:
+            return [], []
+        try:
+            return read_jar_metadata_lines(file)
+        except (zipfile.BadZipFile, OSError) as error:
+            report(f"could not read jar {file}: {error}")
+            return [], []
+
     def get_manifest_file_lines(self):
         if (self.is_tycho()):
-            file = self.get_jar_with_manifest_for_p2()
-            if file is None:
-                return []
-            zip1 = zipfile.ZipFile(file)
-            manifest_file = zipfile.Path(zip1).joinpath(manifest_path)
-            lines = []
-            with manifest_file.open('r') as file:
-                lines = file.readlines()
-            # return list(map(lambda x: x.decode('utf8').rstrip("\n\r"), lines))
-            return list(map(lambda x: x.rstrip("\n\r"), lines))
-
+            return self.get_jar_metadata_lines()[0]
         else:
             manifest_file = self.get_manifest_file_for_eclipse()
+            if manifest_file is None:
+                raise FileNotFoundError(f"{self.name}: no {manifest_path} in {self.proj.module_path()}")
             with manifest_file.open('r') as file:
                 lines = file.readlines()
-            return list(map(lambda x: x.strip(), lines))
+            # leading spaces mark continuation lines, they must stay
+            return list(map(lambda x: x.rstrip("\n\r"), lines))
 
     def get_p2_info_file_lines(self):
         if (self.is_tycho()):
-            file = self.get_jar_with_manifest_for_p2()
-            if file is None:
-                return []
-            zip_jar = zipfile.ZipFile(file)
-            p2_file = zipfile.Path(zip_jar).joinpath(p2_info_path)
-            lines = []
-            if not p2_file.exists():
-                return []
-            with p2_file.open('r') as file:
-                lines = file.readlines()
-            return list(map(lambda x: x.rstrip("\n\r"), lines))
-            # return list(map(lambda x: x.decode('utf8').rstrip("\n\r"), lines))
+            return self.get_jar_metadata_lines()[1]
         else:
             return []
 
-    def update_dependencies(self):
-        manifest_lines = self.get_manifest_file_lines()
-        p2_info_lines = self.get_p2_info_file_lines()
+    def parse_metadata(self):
+        '''Returns required bundles, exported packages and imported packages
+        '''
+        dependencies = []
+        exports = []
+        imports = []
+        if self.is_tycho():
+            manifest_lines, p2_info_lines = self.get_jar_metadata_lines()
+        else:
+            manifest_lines, p2_info_lines = self.get_manifest_file_lines(), []
         if len(manifest_lines) != 0:
-            dependencies = parse_manifest_file_lines(manifest_lines)
-            self.dependencies = dependencies
+            bundle_manifest = BundleManifest.parse(manifest_lines)
+            dependencies = bundle_manifest.required_bundles()
+            exports = bundle_manifest.package_exports()
+            imports = bundle_manifest.package_imports()
 
         if p2_info_lines is not None and len(p2_info_lines) != 0:
-            dependencies = parse_p2_info_file_lines(p2_info_lines)
-            self.dependencies.extend(dependencies)
+            dependencies.extend(parse_p2_info_file_lines(p2_info_lines))
+        return dependencies, exports, imports
+
+    def parse_dependencies(self) -> List[Dependency]:
+        return self.parse_metadata()[0]
+
+    def update_dependencies(self):
+        store = self.metadata_store() if self.is_tycho() else None
+        jar = self.get_jar_with_manifest_for_p2() if store is not None else None
+        if jar is None:
+            dependencies, exports, imports = self.parse_metadata()
+        else:
+            # imports of the pool bundles are never followed, they are not reexported
+            imports = []
+            record = store.get(jar)
+            if record is None:
+                dependencies, exports, _ = self.parse_metadata()
+                store.put(jar, dependencies, exports)
+            else:
+                dependencies, exports = record
+        if len(dependencies) != 0:
+            self.dependencies = dependencies
+        self.exports = exports
+        self.imports = imports
 
     def get_dependencies(self, show_proj_siblings=True):
         if (len(self.dependencies) == 0):
-            print("possibly the dependencies are not yet updated")
+            report("possibly the dependencies are not yet updated")
             return []
         if (show_proj_siblings or (not show_proj_siblings and self.is_tycho())):
             return self.dependencies
@@ -219,19 +1130,19 @@ class Bundle:
 
     def __str__(self):
         exported = self.get_exported_dependencies()
-        return f"{self.name} | {len(self.jars)} jars | {len(self.dependencies)} deps | {len(exported)} exported"
+        return f"{self.display_name()} | {len(self.jars)} jars | {len(self.dependencies)} deps | {len(exported)} exported"
 
     def __repr__(self):
         exported = self.get_exported_dependencies()
-        return f"{self.name} | {len(self.jars)} jars | {len(self.dependencies)} deps | {len(exported)} exported"
+        return f"{self.display_name()} | {len(self.jars)} jars | {len(self.dependencies)} deps | {len(exported)} exported"
 
     def __hash__(self) -> int:
-        return hash(self.name)
+        return hash((self.name, self.version))
 
     def __eq__(self, o: object) -> bool:
         if not isinstance(o, Bundle):
             return False
-        return self.name == o.name
+        return self.name == o.name and self.version == o.version
 
     def __ne__(self, o: object) -> bool:
         return not self == o
@@ -249,73 +1160,233 @@ class Bundle:
         if self.dependencies is None or len(self.dependencies) == 0:
             self.update_dependencies()
 
+    def get_requirements(self):
+        # if collecting deps for eclipse project then must collect all, not only exported, and omit sibling projects
+        return list(filter(lambda x: not self.proj.is_in_root(x.name), self.dependencies))
+
+    def get_package_requirements(self) -> List[PackageImport]:
+        # packages of the module itself and of sibling projects are not looked up in the pool
+        workspace = self.proj.workspace()
+        own = set(map(lambda x: x[0], self.exports))
+        return list(filter(lambda x: x.name not in own and workspace.package_folder(x.name) is None, self.imports))
+
+    def get_project_references(self):
+        # sibling projects are referenced as projects, their own classpath exports their dependencies
+        workspace = self.proj.workspace()
+        folders = list(map(lambda x: workspace.project_folder(x.name), self.dependencies))
+        folders.extend(map(lambda x: workspace.package_folder(x.name), self.imports))
+        folders = filter(lambda x: x is not None and x != self.proj.module_root, folders)
+        return sorted(set(folders))
+
     # collect the whole dependencies hierarchy
-    def collect_exported_dependencies(self, clean_cache = False):
-        # first must check if cache is present because parsing all dependencies is not a fast process
-        exported_dependencies = []
-        if not self.is_tycho() and self.has_dependencies_cache_file() and not clean_cache:
-            return set(self.collect_exported_dependencies_from_cache())
+    def collect_exported_dependencies(self, resolver = None):
+        self.update_jars_if_must()
+        self.update_dependencies_if_must()
+        if self.is_tycho():
+            exported_dependencies = self.get_exported_dependencies()
         else:
-            # parse all
-            self.update_jars_if_must()
-            self.update_dependencies_if_must()
-            if self.is_tycho():
-                exported_dependencies = self.get_exported_dependencies()
-            else:
-                # if collecting deps for eclipse project then must collect all, not only exported, and omit sibling projects
-                exported_dependencies = list(
-                    filter(lambda x: not self.proj.is_in_root(x.name), self.dependencies))
-            bundles = list(map(lambda x: x.to_bundle(
-                self.p2_rep), exported_dependencies))
-            # pretty_print(bundles)
-            for i in bundles:
-                i.update_jars()
-                i.update_dependencies()
-            temp_arr = []
-
-            for i in bundles:
-                # print(f"dependencies for bundle: {i}")
-                i_deps = i.collect_exported_dependencies()
-                temp_arr.extend(i_deps)
-            this_level_dependencies = set(bundles)
-            nested_dependencies = set(temp_arr)
-            full_set = list(this_level_dependencies.union(
-                list(nested_dependencies)))
-            # after all dependencies found, need to filter out those without jars
-            full_set = list(
-                filter(lambda x: x.jars is not None and len(x.jars) > 0, full_set))
-            return set(full_set)
+            exported_dependencies = self.get_requirements()
+        if resolver is None:
+            resolver = DependencyResolver(self.p2_rep, self.cache_folder)
+        return resolver.collect(exported_dependencies)
 
     def check_that_classpath_merged(self) -> bool :
-        classpath_file = self.proj.get_classpath_file()
-        lines = []
-        with classpath_file.open('r') as readable:
-            lines = readable.readlines()
-        for line in lines:
-            # if that line is encountered, the file is merged
-            if re.match(classpath_autogen_line_pattern, line) is not None:
-                return True
-        # not merged
-        return False
+        return ClasspathFile.read(self.proj.get_classpath_file()).merged
 
-    def merge_with_classpath(self, clean_cache=False):
-        # only if it is eclipse project and classpath is not merged
+    def pending_requirements(self, clean_cache=False, incremental=False) -> List[Dependency]:
+        '''Requirements that resolve_classpath will have to resolve with the same arguments
+        '''
         if self.is_tycho():
+            return []
+        # parsing all dependencies is not a fast process, a cache that still matches the inputs is used instead
+        if not clean_cache and self.read_fresh_dependencies_cache() is not None:
+            return []
+        self.update_dependencies_if_must()
+        requirements = self.get_requirements()
+        previous = self.read_incremental_base() if incremental and not clean_cache else None
+        if previous is not None:
+            requirements = list(filter(lambda x: requirement_key(x) not in previous["requirements"], requirements))
+        if not clean_cache:
+            # closures other workspaces resolved are looked up, not crawled
+            indexed = self.indexed_closures(requirements)
+            requirements = list(filter(lambda x: requirement_key(x) not in indexed, requirements))
+        return requirements
+
+    def resolve_classpath(self, clean_cache=False, resolver=None, incremental=False, dry_run=False, classpath_jar=False):
+        '''Returns the resolved closure (cache record with "jars" and "projects" to put into the classpath),
+        or None if the classpath is already up to date.
+        When incremental, only requirements added since the last resolution are resolved.
+        A dry run always returns the closure. The closure is cached by write_classpath, once the classpath is written
+        '''
+        if self.is_tycho():
+            return None
+        cache = None if clean_cache else self.read_fresh_dependencies_cache()
+        if cache is not None:
+            if not dry_run and self.classpath_up_to_date(cache, classpath_jar):
+                report("already converted to code")
+                return None
+            return cache
+        self.update_dependencies_if_must()
+        if resolver is None:
+            resolver = DependencyResolver(self.p2_rep, self.cache_folder)
+        dependencies = self.get_requirements()
+        packages = self.get_package_requirements()
+        keys = list(map(lambda x: requirement_key(x), dependencies)) + list(map(lambda x: package_requirement_key(x), packages))
+        previous = self.read_incremental_base() if incremental and not clean_cache else None
+        if previous is None:
+            requirements = self.resolve_requirements(dependencies, resolver, use_index=not clean_cache)
+        else:
+            resolved_before = previous["requirements"]
+            added = list(filter(lambda x: requirement_key(x) not in resolved_before, dependencies))
+            packages = list(filter(lambda x: package_requirement_key(x) not in resolved_before, packages))
+            current = set(keys)
+            removed = list(filter(lambda x: x not in current, resolved_before.keys()))
+            report(f"{self.name}: {len(added) + len(packages)} requirements added, {len(removed)} removed since the last conversion")
+            requirements = self.resolve_requirements(added, resolver)
+            for key in current:
+                if key in resolved_before:
+                    requirements[key] = resolved_before[key]
+            self.previous_resolution = previous
+        requirements.update(self.resolve_package_requirements(packages, resolver, requirements))
+        # keep the order of the manifest, it is the order of the classpath
+        requirements = dict(map(lambda x: (x, requirements[x]), keys))
+        return self.cache_resolution(requirements, self.get_project_references(), resolver)
+
+    def indexed_closures(self, dependencies: List[Dependency]) -> dict:
+        index = P2Index.of_repository(self.p2_rep)
+        if index is None or len(dependencies) == 0:
+            return {}
+        return index.get_closures(self.p2_rep, self.catalog().get_listing_digest(),
+                                  list(map(lambda x: requirement_key(x), dependencies)))
+
+    def resolve_requirements(self, dependencies: List[Dependency], resolver, use_index=True) -> dict:
+        indexed = self.indexed_closures(dependencies) if use_index else {}
+        if len(indexed) != 0:
+            P2Index.of_repository(self.p2_rep).closure_hits += len(indexed)
+            instrumentation.count("p2 index closure hits", len(indexed))
+        dependencies = list(filter(lambda x: requirement_key(x) not in indexed, dependencies))
+        requirements = {}
+        resolver.prefetch_dependencies(dependencies)
+        for dependency in dependencies:
+            bundles = sorted(resolver.collect([dependency]), key=lambda x: (x.name, str(x.version)))
+            jars = []
+            sources = {}
+            for bundle in bundles:
+                bundle_jars, bundle_sources = bundle.classpath_jars()
+                jars.extend(bundle_jars)
+                sources.update(bundle_sources)
+            requirements[requirement_key(dependency)] = {
+                "bundles": list(map(lambda x: [x.name, x.version], bundles)),
+                "jars": jars,
+                "sources": sources,
+            }
+        index = P2Index.of_repository(self.p2_rep)
+        if index is not None:
+            index.put_closures(self.p2_rep, self.catalog().get_listing_digest(), requirements)
+        requirements.update(indexed)
+        return requirements
+
+    def resolve_package_requirements(self, packages: List[PackageImport], resolver, requirements: dict) -> dict:
+        '''Each imported package is resolved to one bundle that exports it, without the bundles it reexports.
+        A bundle that is already required is preferred, so imports often add nothing to the classpath
+        '''
+        if len(packages) == 0:
+            return {}
+        index = PackageIndex.for_repository(self.p2_rep)
+        index.build_if_must(self.cache_folder, resolver.jobs)
+        preferred = set(flat_map(lambda x: list(map(lambda y: tuple(y), x["bundles"])), requirements.values()))
+        resolved = {}
+        for package in packages:
+            providers = index.providers_of(package)
+            if len(providers) == 0:
+                if not package.optional:
+                    report(f"{self.name}: no bundle of the p2 pool exports package {package}")
+                resolved[package_requirement_key(package)] = {"bundles": [], "jars": [], "sources": {}}
+                continue
+            provider = next(filter(lambda x: x in preferred, providers), providers[0])
+            preferred.add(provider)
+            name, version = provider
+            bundle = resolver.bundle(resolver.id_of(Dependency(name, version_range=VersionRange.parse(f"[{version},{version}]"))))
+            jars, sources = bundle.classpath_jars()
+            resolved[package_requirement_key(package)] = {
+                "bundles": [[bundle.name, bundle.version]],
+                "jars": jars,
+                "sources": sources,
+            }
+        return resolved
+
+    def read_incremental_base(self):
+        '''Last resolution of the module if only its manifest changed since and the classpath was generated from it
+        '''
+        previous = self.load_dependencies_cache()
+        if previous is None or "requirements" not in previous or not self.check_that_classpath_merged():
+            return None
+        fingerprint = dict(self.dependencies_cache_fingerprint())
+        fingerprint["manifest"] = previous["fingerprint"].get("manifest")
+        if previous["fingerprint"] != fingerprint:
+            return None
+        return previous
+
+    def classpath_jar_file(self):
+        assert self.cache_folder is not None, "classpath jars are kept in the cache folder"
+        return Path(self.cache_folder).absolute().joinpath(self.name + classpath_jar_suffix)
+
+    def write_classpath(self, resolved, classpath_jar=False):
+        if resolved is None:
             return
-        if self.check_that_classpath_merged():
-            print("already converted to code")
-            return
+        self.update_classpath_file(resolved, classpath_jar)
+        # a fresh cache means the classpath is up to date, so it is only written once the classpath is
+        self.save_dependencies_cache(dict(resolved, classpath_jar=classpath_jar))
 
+    def update_classpath_file(self, resolved, classpath_jar=False):
         classpath_file = self.proj.get_classpath_file()
+        if classpath_jar:
+            # one entry instead of hundreds, the IDE follows Class-Path of the jar
+            jar = self.classpath_jar_file()
+            write_classpath_jar(jar, resolved["jars"])
+            self.previous_resolution = None
+            merge_dependencies_with_classpath(classpath_file, [str(jar)], resolved["projects"])
+            return
+        previous = self.previous_resolution
+        self.previous_resolution = None
+        if previous is not None:
+            # only the changed entries are touched
+            if patch_classpath(classpath_file,
+                               classpath_lines(previous["jars"], previous["projects"], previous["sources"]),
+                               classpath_lines(resolved["jars"], resolved["projects"], resolved["sources"])):
+                return
+            report("classpath was changed by hand, it will be regenerated")
+        # the generated part made from other dependencies is replaced
+        merge_dependencies_with_classpath(classpath_file, resolved["jars"], resolved["projects"], resolved["sources"])
+
+    def plan_classpath(self, resolved, classpath_jar=False):
+        '''Returns the generated lines write_classpath would add to and remove from the classpath file
+        '''
+        if resolved is None:
+            return [], []
+        if classpath_jar:
+            lines = classpath_lines([str(self.classpath_jar_file())], resolved["projects"])
+        else:
+            lines = classpath_lines(resolved["jars"], resolved["projects"], resolved["sources"])
+        generated = ClasspathFile.read(self.proj.get_classpath_file()).generated
+        generated_set = set(generated)
+        lines_set = set(lines)
+        return list(filter(lambda x: x not in generated_set, lines)), list(filter(lambda x: x not in lines_set, generated))
+
+    def classpath_up_to_date(self, resolved, classpath_jar=False) -> bool:
+        '''The generated part of the classpath is the one write_classpath would write, in the same output mode
+        '''
+        if not self.check_that_classpath_merged():
+            return False
+        if classpath_jar and not self.classpath_jar_file().is_file():
+            return False
+        added, removed = self.plan_classpath(resolved, classpath_jar)
+        return len(added) == 0 and len(removed) == 0
 
-        # collect cached or newly parsed dependencies
-        dependencies = list(self.collect_exported_dependencies(clean_cache=clean_cache))
-        # if no cache - put into cache
-        if not self.has_dependencies_cache_file() or clean_cache:
-            self.cache_exported_dependencies(dependencies)
-        # convert to jars
-        dependencies = flat_map(lambda x: x.jars_paths(), dependencies)
-        merge_dependencies_with_classpath(classpath_file, dependencies)
+    def merge_with_classpath(self, clean_cache=False, resolver=None, incremental=False, classpath_jar=False):
+        resolved = self.resolve_classpath(clean_cache=clean_cache, resolver=resolver, incremental=incremental,
+                                          classpath_jar=classpath_jar)
+        self.write_classpath(resolved, classpath_jar)
 
     def clean_classpath(self):
         if not self.is_tycho():
@@ -330,29 +1401,111 @@ class Bundle:
             cache_file = self.cache_file()
         return cache_file.exists() and cache_file.is_file()
 
-    def cache_exported_dependencies(self, exported_dependencies):
-        # must delete cache file if exists
-        cache_file = self.cache_file()
-        if self.has_dependencies_cache_file(cache_file_given=cache_file):
-            cache_file.unlink()
-        # fetch dependencies
-        # exported: List[Dependency] = list(self.collect_exported_dependencies())
-        # lines that will be writtent to the cache file
-        exported = list(map(lambda x: f"{x.to_file_string()}\n", exported_dependencies))
-        with cache_file.open('w') as opened_file:
-            opened_file.writelines(exported)
-    
-    def collect_exported_dependencies_from_cache(self):
+    def dependencies_cache_fingerprint(self):
+        # everything the resolved closure depends on
+        fingerprint = {
+            "format": closure_cache_format,
+            "manifest": file_digest(self.get_manifest_file_for_eclipse()),
+            "p2": os.path.abspath(str(self.p2_rep)),
+            "pool": self.catalog().get_listing_digest(),
+        }
+        if self.used_packages is not None:
+            fingerprint["used_packages"] = hashlib.sha256("\n".join(sorted(self.used_packages)).encode()).hexdigest()
+        return fingerprint
+
+    def scan_used_packages(self):
+        '''Enables pruning: the classpath will only have the bundles exporting packages the sources import
+        '''
+        folders = ClasspathFile.read(self.proj.get_classpath_file()).source_folders()
+        module_path = self.proj.module_path()
+        with instrumentation.phase("scan sources"):
+            packages = scan_imported_packages(list(map(lambda x: module_path.joinpath(x), folders)))
+        if packages is None:
+            report(f"{self.name}: no sources found, the classpath will not be pruned")
+            return
+        self.used_packages = packages
+
+    def prune_bundles(self, bundles: List[list], resolver) -> List[list]:
+        '''Bundles exporting a package the sources import, with the bundles they reexport.
+        Bundles that export no package at all can not be checked and are kept
+        '''
+        index = PackageIndex.for_repository(self.p2_rep)
+        index.build_if_must(self.cache_folder, resolver.jobs)
+        candidates = set(map(lambda x: tuple(x), bundles))
+        used = set(filter(lambda x: x in candidates,
+                          flat_map(lambda x: index.exporters_of(x), self.used_packages)))
+        kept = set(filter(lambda x: x not in index.exporting, candidates))
+        for name, version in used:
+            node = resolver.id_of(Dependency(name, version_range=VersionRange.parse(f"[{version},{version}]")))
+            kept.add(resolver.keys[node])
+            kept.update(map(lambda x: resolver.keys[x], resolver.resolve(node)))
+        pruned = list(filter(lambda x: tuple(x) in kept, bundles))
+        report(f"{self.name}: {len(pruned)} of {len(bundles)} bundles are used by the sources")
+        return pruned
+
+    def read_fresh_dependencies_cache(self):
+        '''Returns the cached closure if it was resolved from the current manifest and p2 pool, None otherwise
+        '''
+        loaded, cache = self.fresh_cache
+        if not loaded:
+            cache = self.load_dependencies_cache()
+            if cache is not None and cache.get("fingerprint") != self.dependencies_cache_fingerprint():
+                cache = None
+            instrumentation.count("closure cache misses" if cache is None else "closure cache hits")
+            self.fresh_cache = (True, cache)
+        return cache
+
+    def load_dependencies_cache(self):
+        if self.cache_folder is None or not self.has_dependencies_cache_file():
+            return None
+        try:
+            with self.cache_file().open('r') as opened_file:
+                cache = load(opened_file)
+        except (JSONDecodeError, UnicodeDecodeError, OSError):
+            return None
+        # plain list of names written by older versions of the tool
+        if not isinstance(cache, dict):
+            return None
+        return cache
+
+    def cache_resolution(self, requirements: dict, projects=[], resolver=None):
+        bundles = []
+        jars = []
+        sources = {}
+        for requirement in requirements.values():
+            bundles.extend(requirement["bundles"])
+            jars.extend(requirement["jars"])
+            sources.update(requirement["sources"])
+        if self.used_packages is not None and resolver is not None:
+            # requirements stay whole so that the next incremental conversion can reuse them
+            bundles = self.prune_bundles(unique(bundles), resolver)
+            jars = []
+            sources = {}
+            for name, version in bundles:
+                bundle_jars, bundle_sources = Bundle(self.p2_rep, name, version=version).classpath_jars()
+                jars.extend(bundle_jars)
+                sources.update(bundle_sources)
+        cache = {
+            "fingerprint": self.dependencies_cache_fingerprint(),
+            # closure of every direct requirement, lets the next conversion resolve only what was added
+            "requirements": requirements,
+            "bundles": unique(bundles),
+            "jars": unique(jars),
+            "sources": sources,
+            "projects": projects,
+        }
+        return cache
+
+    def save_dependencies_cache(self, cache: dict):
+        if self.cache_folder is None:
+            return
         cache_file = self.cache_file()
-        lines = []
-        with cache_file.open('r') as opened_file:
-            lines = opened_file.readlines()
-        dependencies = list(map(lambda x: x.replace("\n", ''), lines))
-        dependencies = list(filter(lambda x: len(x) != 0, dependencies))
-        dependencies = list(map(lambda x: Bundle(self.p2_rep,x), dependencies))
-        for bundle in dependencies:
-            bundle.update_jars()
-        return dependencies
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = cache_file.with_name(cache_file.name + ".tmp")
+        with temp_file.open('w') as opened_file:
+            dump(cache, opened_file, indent=1)
+        os.replace(temp_file, cache_file)
+        self.fresh_cache = (True, cache)
 
     def add_magic_line_to_settings(self):
         settings_file = self.proj.module_path().joinpath(settings_file_subpath)
@@ -377,109 +1530,693 @@ class Bundle:
                 writable.writelines(lines)
 
 
-def split_by_commas(lines):
-    parenthesis_stack = []
-    new_lines = []
-    last_index = 0
-    for index, i in enumerate(lines):
-        if (i == '"'):
-            if (len(parenthesis_stack) > 0):
-                parenthesis_stack.pop()
+class PackageIndex:
+    '''Bundles of a p2 pool by the packages they export, made from the Export-Package headers of all binary jars.
+    Jars are read through the metadata store, so only new jars of the pool are opened.
+    Use for_repository to get the index shared by all bundles of the same repository.
+    '''
+    _shared = {}
+
+    def __init__(self, p2_rep):
+        self.p2_rep = p2_rep if isinstance(p2_rep, Path) else Path(p2_rep)
+        # package -> [(bundle name, bundle version, package version)]
+        self.providers = {}
+        # (bundle name, bundle version) of the bundles exporting any package
+        self.exporting = set()
+        self.listing_digest = None
+
+    @classmethod
+    def for_repository(cls, p2_rep):
+        key = os.path.abspath(os.path.expanduser(str(p2_rep)))
+        index = cls._shared.get(key)
+        if index is None:
+            index = cls(p2_rep)
+            cls._shared[key] = index
+        return index
+
+    def build(self, cache_folder: str = None, jobs=1):
+        catalog = P2Catalog.for_repository(self.p2_rep)
+        catalog.scan_if_must()
+        # shared state is created here so that the workers only use it
+        store = metadata_store_of(self.p2_rep, cache_folder)
+        if store is not None:
+            store.load_if_must()
+        entries = map(lambda x: catalog.entries[x], sorted(catalog.entries.keys()))
+        bundles = flat_map(lambda x: list(map(lambda y: Bundle(self.p2_rep, x.name, cache_folder=cache_folder, version=y),
+                                              x.binary_versions())), entries)
+
+        def load_bundle(bundle: Bundle):
+            bundle.update_jars()
+            bundle.update_dependencies()
+
+        with instrumentation.phase("index exported packages"), ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            list(executor.map(load_bundle, bundles))
+        providers = {}
+        for bundle in bundles:
+            for package, version in bundle.exports:
+                try:
+                    version = OsgiVersion.of(version)
+                except ValueError:
+                    # not an OSGi version, the package still satisfies imports without a range
+                    version = OsgiVersion.of("0.0.0")
+                providers.setdefault(package, []).append((bundle.name, bundle.version, version))
+        self.providers = providers
+        self.exporting = set(flat_map(lambda x: list(map(lambda y: (y[0], y[1]), x)), providers.values()))
+        self.listing_digest = catalog.get_listing_digest()
+
+    def build_if_must(self, cache_folder: str = None, jobs=1):
+        # the pool may have been rescanned since, e.g. in watch mode
+        if self.listing_digest != P2Catalog.for_repository(self.p2_rep).get_listing_digest():
+            self.build(cache_folder, jobs)
+
+    def exporters_of(self, package: str) -> List[tuple]:
+        return list(map(lambda x: (x[0], x[1]), self.providers.get(package, [])))
+
+    def providers_of(self, package: PackageImport) -> List[tuple]:
+        '''(name, version) of the bundles exporting the package in the range, the highest package version first
+        '''
+        candidates = filter(lambda x: package.version_range.includes(x[2]), self.providers.get(package.name, []))
+        candidates = sorted(candidates, key=lambda x: (x[2], OsgiVersion.of(x[1])), reverse=True)
+        return list(map(lambda x: (x[0], x[1]), candidates))
+
+
+class DependencyResolver:
+    '''Resolves transitive exported (reexported) dependencies of p2 bundles.
+    Every (bundle name, version) becomes a single node with an integer id that is parsed once.
+    Exported edges and the memoized exported closure of every node are kept as arrays of ids,
+    so bundles shared by many paths are resolved only once and cost a few bytes per edge.
+    The version of a node is the best one in the pool for the bundle-version range of the requirement.
+    Reexport cycles are resolved as strongly connected components: all their members share one closure.
+    With jobs > 1 the jars of every breadth first frontier of the graph are read and parsed in parallel
+    before the closures are computed.
+    '''
+    def __init__(self, p2_rep: str, cache_folder: str = None, jobs: int = 1):
+        self.p2_rep = Path(p2_rep)
+        self.cache_folder = cache_folder
+        self.jobs = jobs
+        # (name, version) -> id
+        self.ids = {}
+        # by id: (name, version), loaded Bundle or None, array of exported successor ids, array of closure ids
+        self.keys = []
+        self.nodes = []
+        self.edges = []
+        self.closures = []
+        self.cycles = []
+        self.visits = 0
+        self.cache_hits = 0
+
+    def catalog(self) -> P2Catalog:
+        return P2Catalog.for_repository(self.p2_rep)
+
+    def key_of(self, dependency: Dependency):
+        return dependency.name, self.catalog().select_version(dependency.name, dependency.version_range)
+
+    def node_id(self, key) -> int:
+        node = self.ids.get(key)
+        if node is None:
+            node = len(self.keys)
+            self.ids[key] = node
+            self.keys.append(key)
+            self.nodes.append(None)
+            self.edges.append(None)
+            self.closures.append(None)
+        return node
+
+    def id_of(self, dependency: Dependency) -> int:
+        return self.node_id(self.key_of(dependency))
+
+    def new_bundle(self, node: int) -> Bundle:
+        name, version = self.keys[node]
+        bundle = Bundle(self.p2_rep, name, cache_folder=self.cache_folder, version=version)
+        bundle.update_jars()
+        return bundle
+
+    def add_bundle(self, node: int, bundle: Bundle):
+        self.nodes[node] = bundle
+        self.edges[node] = array('i', map(lambda x: self.id_of(x), bundle.get_exported_dependencies()))
+        self.visits += 1
+
+    def bundle(self, node: int) -> Bundle:
+        bundle = self.nodes[node]
+        if bundle is None:
+            bundle = self.new_bundle(node)
+            bundle.update_dependencies()
+            self.add_bundle(node, bundle)
+        return bundle
+
+    def prefetch(self, nodes):
+        '''Loads all bundles reachable from the given nodes, breadth first, one parallel batch per frontier
+        '''
+        frontier = set(filter(lambda x: self.nodes[x] is None, nodes))
+        if self.jobs <= 1 or len(frontier) == 0:
+            return
+        # shared state is created here so that the workers only use it
+        self.catalog().scan_if_must()
+        store = metadata_store_of(self.p2_rep, self.cache_folder)
+        if store is not None:
+            store.load_if_must()
+        with instrumentation.phase("prefetch"), ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            while len(frontier) > 0:
+                batch = list(frontier)
+                bundles = list(map(lambda x: self.new_bundle(x), batch))
+                list(executor.map(lambda x: x.update_dependencies(), bundles))
+                frontier = set()
+                for node, bundle in zip(batch, bundles):
+                    self.add_bundle(node, bundle)
+                for node in batch:
+                    frontier.update(filter(lambda x: self.nodes[x] is None, self.edges[node]))
+
+    def prefetch_dependencies(self, dependencies: List[Dependency]):
+        self.prefetch(list(map(lambda x: self.id_of(x), dependencies)))
+
+    def successors(self, node: int):
+        self.bundle(node)
+        return self.edges[node]
+
+    def resolve(self, node: int):
+        '''Returns ids of all bundles exported by the given one, directly or transitively
+        '''
+        if self.closures[node] is not None:
+            self.cache_hits += 1
+            return self.closures[node]
+        # iterative Tarjan: recursion over deep reexport chains would hit the interpreter limit
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        work = [(node, iter(self.successors(node)))]
+        index[node] = low[node] = 0
+        stack.append(node)
+        on_stack.add(node)
+        while len(work) > 0:
+            current, successors = work[-1]
+            descended = False
+            for successor in successors:
+                if self.closures[successor] is not None:
+                    self.cache_hits += 1
+                elif successor not in index:
+                    index[successor] = low[successor] = len(index)
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor, iter(self.successors(successor))))
+                    descended = True
+                    break
+                elif successor in on_stack:
+                    low[current] = min(low[current], index[successor])
+            if descended:
+                continue
+            work.pop()
+            if len(work) > 0:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[current])
+            if low[current] == index[current]:
+                self.close_component(current, stack, on_stack)
+        return self.closures[node]
+
+    def close_component(self, root: int, stack: list, on_stack: set):
+        component = []
+        while True:
+            member = stack.pop()
+            on_stack.discard(member)
+            component.append(member)
+            if member == root:
+                break
+        members = set(component)
+        closure = set()
+        for member in component:
+            for successor in self.edges[member]:
+                closure.add(successor)
+                if successor not in members:
+                    closure.update(self.closures[successor])
+        if len(component) > 1 or root in closure:
+            self.cycles.append(sorted(map(lambda x: self.keys[x][0], component)))
+        # one array shared by all members of the component
+        closure = array('i', sorted(closure))
+        for member in component:
+            self.closures[member] = closure
+
+    def collect(self, dependencies: List[Dependency]) -> Set[Bundle]:
+        self.prefetch_dependencies(dependencies)
+        nodes = set()
+        with instrumentation.phase("resolve closures"):
+            for dependency in dependencies:
+                node = self.id_of(dependency)
+                nodes.add(node)
+                nodes.update(self.resolve(node))
+        bundles = map(lambda x: self.bundle(x), nodes)
+        # after all dependencies found, need to filter out those without jars
+        return set(filter(lambda x: x.jars is not None and len(x.jars) > 0, bundles))
+
+    def export_graph(self, modules: List[Bundle], resolutions: dict = {}) -> dict:
+        '''Submodules and the bundles of their closures with every requirement between them (reexported or not),
+        the size of the binary jar of each bundle and of the classpath of each submodule
+        '''
+        for module in modules:
+            self.collect(module.get_requirements())
+        catalog = self.catalog()
+        plugins = self.p2_rep.joinpath(plugins_subpath)
+        nodes = {}
+        edges = []
+
+        def bundle_node(name: str, version: str):
+            key = f"{name}_{version}" if version is not None else name
+            if key not in nodes:
+                entry = catalog.entry(name)
+                jar = entry.binaries.get(version) if entry is not None else None
+                nodes[key] = {
+                    "id": key, "kind": "bundle", "name": name, "version": version, "missing": version is None,
+                    "jar_bytes": os.path.getsize(plugins.joinpath(jar)) if jar is not None else 0,
+                }
+            return key
+
+        def add_edge(source: str, target: str, dependency: Dependency):
+            edges.append({"from": source, "to": target, "reexport": dependency.exported,
+                          "range": str(dependency.version_range)})
+
+        for module in modules:
+            resolved = resolutions.get(module.name)
+            nodes[module.name] = {
+                "id": module.name, "kind": "module", "name": module.name, "version": None, "missing": False,
+                "jar_bytes": 0,
+                "classpath_jars": len(resolved["jars"]) if resolved is not None else None,
+                "classpath_bytes": sum(map(lambda x: os.path.getsize(x) if os.path.exists(x) else 0,
+                                           resolved["jars"])) if resolved is not None else None,
+            }
+            workspace = module.proj.workspace()
+            for dependency in module.dependencies:
+                folder = workspace.project_folder(dependency.name)
+                if folder is not None:
+                    nodes.setdefault(dependency.name, {"id": dependency.name, "kind": "project", "name": dependency.name,
+                                                       "version": None, "missing": False, "jar_bytes": 0})
+                    add_edge(module.name, dependency.name, dependency)
+                else:
+                    add_edge(module.name, bundle_node(*self.key_of(dependency)), dependency)
+            requirements = resolved["requirements"] if resolved is not None else {}
+            for key, requirement in requirements.items():
+                # Import-Package requirements are resolved to exactly one bundle
+                if key.startswith("package ") and len(requirement["bundles"]) != 0:
+                    name, version = requirement["bundles"][0]
+                    edges.append({"from": module.name, "to": bundle_node(name, version), "reexport": False,
+                                  "range": key.split(";", 1)[1], "package": key[len("package "):].split(";", 1)[0]})
+        for node, bundle in enumerate(self.nodes):
+            if bundle is None:
+                continue
+            source = bundle_node(*self.keys[node])
+            for dependency in bundle.dependencies:
+                add_edge(source, bundle_node(*self.key_of(dependency)), dependency)
+        return {"nodes": list(nodes.values()), "edges": edges, "stats": self.stats(), "cycles": self.cycles}
+
+    def stats(self):
+        return {
+            "bundles": len(self.keys),
+            "edges": sum(map(lambda x: 0 if x is None else len(x), self.edges)),
+            "visits": self.visits,
+            "cache_hits": self.cache_hits,
+            "cycles": len(self.cycles),
+        }
+
+    def __str__(self):
+        stats = self.stats()
+        return " | ".join(map(lambda x: f"{x[1]} {x[0]}", stats.items()))
+
+
+class ManifestClause:
+    '''One comma separated clause of a manifest header: names (paths) followed by
+    attributes (key=value) and directives (key:=value)
+    '''
+    __slots__ = ("names", "attributes", "directives")
+
+    def __init__(self, names: List[str] = None, attributes: dict = None, directives: dict = None):
+        self.names = names if names is not None else []
+        self.attributes = attributes if attributes is not None else {}
+        self.directives = directives if directives is not None else {}
+
+    def __repr__(self):
+        return f"{';'.join(self.names)} {self.attributes} {self.directives}"
+
+
+def unquote(value: str) -> str:
+    value = value.strip()
+    if len(value) >= 2 and value[0] == '"' and value[-1] == '"':
+        return value[1:-1]
+    return value
+
+
+def parse_clauses(value: str) -> List[ManifestClause]:
+    clauses = []
+    for clause_text in clause_split_pattern.findall(value):
+        clause = ManifestClause()
+        for parameter in parameter_split_pattern.findall(clause_text):
+            parameter = parameter.strip()
+            equals = parameter.find('=')
+            if equals < 0:
+                if len(parameter) != 0:
+                    clause.names.append(parameter)
+            elif equals > 0 and parameter[equals - 1] == ':':
+                clause.directives[parameter[:equals - 1].strip()] = unquote(parameter[equals + 1:])
             else:
-                parenthesis_stack.append(i)
-        elif (i == ','):
-            if len(parenthesis_stack) == 0:
-                new_lines.append(lines[last_index:index].strip())
-                last_index = index + 1
-    new_lines.append(lines[last_index:].strip())
-    return new_lines
+                # typed attributes look like version:Version="1.0"
+                key = parameter[:equals].split(':')[0].strip()
+                clause.attributes[key] = unquote(parameter[equals + 1:])
+        if len(clause.names) != 0:
+            clauses.append(clause)
+    return clauses
 
 
-def parse_manifest_file_lines(lines) -> List[Dependency]:
-    require_block_declaration_pattern = re.compile(
-        r"[\s]*({})[\s]*:[\s]*.*".format(dependency_declaration_keyword))
-    block_declaration_pattern = re.compile(r"[a-zA-Z-]*:[\ ]*.*")
-    first_match = False
-    first_index = 0
-    for index, i in enumerate(lines):
-        if re.fullmatch(require_block_declaration_pattern, i) is not None:
-            first_index = index
-            first_match = True
+def parse_manifest_headers(lines) -> dict:
+    '''Headers of the main section of a manifest, continuation lines (starting with a space) are unfolded
+    '''
+    instrumentation.count("manifests parsed")
+    headers = {}
+    name = None
+    parts = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line.startswith(' '):
+            if name is not None:
+                parts.append(line[1:])
             continue
-        if first_match and re.fullmatch(block_declaration_pattern, i) is not None:
-            lines = lines[first_index:index]
-            break
-    # no match found
-    if not first_match:
-        return []
-    lines = list(map(lambda x: x.strip(), lines))
-    lines = ''.join(lines)
-    lines = lines.strip()[lines.find(dependency_declaration_keyword) +
-                          len(dependency_declaration_keyword + dependency_declaration_word_end):]
-    lines = split_by_commas(lines)
-    # can be case when ',' was inside brackets
-    dependencies = list(map(lambda x: Dependency(x.strip()), lines))
-    return dependencies
+        if name is not None:
+            headers[name] = ''.join(parts).strip()
+            name = None
+        if len(line.strip()) == 0:
+            # the main section ends with the first empty line
+            if len(headers) != 0:
+                break
+            continue
+        colon = line.find(':')
+        if colon <= 0:
+            continue
+        name = line[:colon].strip()
+        parts = [line[colon + 1:]]
+    if name is not None:
+        headers[name] = ''.join(parts).strip()
+    return headers
 
 
-def parse_p2_info_file_lines(lines) -> List[Dependency]:
-    requires_pattern = re.compile(
-        r"[\s]*(requires)\.[0-9]+\.(name)[\s]*\=[\s]*.*")
+class BundleManifest:
+    '''Parsed main section of a MANIFEST.MF with access to the OSGi headers
+    '''
+    def __init__(self, headers: dict):
+        self.headers = headers
+
+    @classmethod
+    def parse(cls, lines):
+        return cls(parse_manifest_headers(lines))
+
+    def clauses(self, header: str) -> List[ManifestClause]:
+        value = self.headers.get(header)
+        if value is None:
+            return []
+        return parse_clauses(value)
+
+    def symbolic_name(self):
+        clauses = self.clauses(symbolic_name_keyword)
+        if len(clauses) == 0:
+            return None
+        return clauses[0].names[0]
+
+    def version(self):
+        return self.headers.get(bundle_version_keyword)
+
+    def required_bundles(self) -> List[Dependency]:
+        return flat_map(lambda x: list(map(lambda y: Dependency.from_clause(x, y), x.names)),
+                        self.clauses(dependency_declaration_keyword))
+
+    def imported_packages(self) -> List[ManifestClause]:
+        return self.clauses(import_package_keyword)
+
+    def exported_packages(self) -> List[ManifestClause]:
+        return self.clauses(export_package_keyword)
+
+    def package_imports(self) -> List[PackageImport]:
+        return flat_map(lambda x: list(map(lambda y: PackageImport.from_clause(x, y), x.names)), self.imported_packages())
+
+    def package_exports(self) -> List[list]:
+        # [package, version], a package exported without a version has version 0.0.0
+        return flat_map(lambda x: list(map(lambda y: [sys.intern(y), x.attributes.get("version", "0.0.0")], x.names)),
+                        self.exported_packages())
+
+    def fragment_host(self):
+        clauses = self.clauses(fragment_host_keyword)
+        if len(clauses) == 0:
+            return None
+        return clauses[0]
+
+
+def parse_manifest_file_lines(lines) -> List[Dependency]:
+    return BundleManifest.parse(lines).required_bundles()
 
-    requirements = list(filter(lambda x: re.fullmatch(
-        requires_pattern, x) is not None, lines))
 
-    def delete_keywords_part(line: str):
-        lines1 = line.split("=")
-        line1 = lines1[1].strip()
-        return line1
-    requirements = list(map(lambda x: delete_keywords_part(x), requirements))
-    requirements = list(map(lambda x: Dependency(
-        x, is_p2_required_line=True), requirements))
-    return requirements
+def parse_p2_info_file_lines(lines) -> List[Dependency]:
+    # requires.<n>.name = <bundle>, requires.<n>.range = <version range>
+    names = {}
+    ranges = {}
+    for line in lines:
+        key, separator, value = line.partition('=')
+        if len(separator) == 0:
+            continue
+        key_parts = key.strip().split('.')
+        if len(key_parts) != 3 or key_parts[0] != "requires":
+            continue
+        if key_parts[2] == "name":
+            names[key_parts[1]] = value.strip()
+        elif key_parts[2] == "range":
+            ranges[key_parts[1]] = value.strip()
+    return list(map(lambda x: Dependency(x[1], True, VersionRange.parse(ranges.get(x[0]))), names.items()))
 
 
-def merge_dependencies_with_classpath(file: Path, dependencies: List[str]):
+def classpath_lines(dependencies: List[str], projects: List[str] = [], sources: dict = {}) -> List[str]:
     lines = []
-    with file.open('r+') as opened_file:
-        lines = opened_file.readlines()
-    with file.open('w+') as opened_file:
-        i_lines = enumerate(lines)
-        i_lines = list(
-            filter(lambda x: x[1].find("</classpath>") >= 0, i_lines))
-        index, line = i_lines[0]
-        diff = len(lines) - index
-        lines.insert(len(lines) - diff, "<!-- BELOW AUTO GEN -->\n")
-        for dependency in dependencies:
+    for project in projects:
+        line = '<classpathentry combineaccessrules="false" exported="true" kind="src" path="/{}"/>\n'
+        lines.append(line.format(project))
+    for dependency in dependencies:
+        source = sources.get(dependency)
+        if source is None:
             line = '<classpathentry exported="true" kind="lib" path="{}"/>\n'
-            line = line.format(dependency)
-            lines.insert(len(lines) - diff, line)
-        opened_file.writelines(lines)
+            lines.append(line.format(dependency))
+        else:
+            # one entry per bundle, the language server indexes the source jar only when navigating
+            line = '<classpathentry exported="true" kind="lib" path="{}" sourcepath="{}"/>\n'
+            lines.append(line.format(dependency, source))
+    return lines
+
+
+def graph_to_dot(graph: dict) -> str:
+    '''Graphviz text of an exported graph, reexported requirements are bold, the others dashed
+    '''
+    shapes = {"module": "folder", "project": "folder", "bundle": "box"}
+    lines = ["digraph bundles {", "  rankdir=LR;"]
+    for node in graph["nodes"]:
+        label = node["id"] if node["jar_bytes"] == 0 else f"{node['id']}\\n{node['jar_bytes'] // 1024} KiB"
+        style = ', style=dotted' if node["missing"] else ''
+        lines.append(f'  "{node["id"]}" [shape={shapes[node["kind"]]}, label="{label}"{style}];')
+    for edge in graph["edges"]:
+        style = "bold" if edge["reexport"] else "dashed"
+        label = f', label="{edge["package"]}"' if "package" in edge else ''
+        lines.append(f'  "{edge["from"]}" -> "{edge["to"]}" [style={style}{label}];')
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def write_graph(file: str, graph: dict):
+    with open(file, 'w') as writable:
+        if file.endswith(".dot") or file.endswith(".gv"):
+            writable.write(graph_to_dot(graph))
+        else:
+            dump(graph, writable, indent=1)
+
+
+def imported_package(name: str, static: bool) -> str:
+    parts = name.split('.')
+    if static:
+        # the last part is a member of a class
+        parts = parts[:-1]
+    # nested classes follow the class, packages are lower case by convention
+    while len(parts) > 1 and parts[-1][:1].isupper():
+        parts = parts[:-1]
+    return ".".join(parts)
+
+
+def scan_source_file_imports(file: str, packages: Set[str]):
+    with open(file, 'r', errors='replace') as readable:
+        for line in readable:
+            line = line.strip()
+            if line.startswith("import "):
+                name = line[len("import "):].strip().rstrip(';').strip()
+                static = name.startswith("static ")
+                if static:
+                    name = name[len("static "):].strip()
+                if name.endswith(".*"):
+                    name = name[:-2]
+                    packages.add(imported_package(name, False) if static else name)
+                else:
+                    packages.add(imported_package(name, static))
+            elif line.startswith(java_declaration_starts):
+                # imports are only allowed before the first type
+                return
+
+
+def scan_imported_packages(folders: List[Path]):
+    '''Packages imported by the Java and Xtend sources of the folders, None if there are no sources.
+    Only the import section of each file is read
+    '''
+    packages = set()
+    files = 0
+    for folder in folders:
+        for directory, _, names in os.walk(folder):
+            for name in names:
+                if name.endswith(java_source_suffixes):
+                    files += 1
+                    scan_source_file_imports(os.path.join(directory, name), packages)
+    instrumentation.count("source files scanned", files)
+    return packages if files != 0 else None
+
+
+def manifest_header_lines(name: str, value: str) -> List[str]:
+    # lines of a manifest are at most 72 bytes, longer ones continue on lines starting with a space
+    header = f"{name}: {value}".encode("utf-8")
+    lines = [header[:72]]
+    lines.extend(map(lambda x: b" " + header[x:x + 71], range(72, len(header), 71)))
+    return list(map(lambda x: x.decode("utf-8", errors="ignore"), lines))
+
+
+def class_path_url(jar: str, folder: Path) -> str:
+    '''Class-Path entries are URLs relative to the folder of the jar that lists them
+    '''
+    try:
+        relative = os.path.relpath(jar, folder)
+    except ValueError:
+        # another drive on Windows
+        return Path(jar).absolute().as_uri()
+    return quote(relative.replace(os.sep, "/"))
+
+
+def write_classpath_jar(file: Path, jars: List[str]) -> bool:
+    '''Writes a jar that only has a manifest with the given jars in Class-Path, returns True if it was written
+    '''
+    file.parent.mkdir(parents=True, exist_ok=True)
+    # not resolved: the IDE resolves the entries against the path of the jar written into .classpath
+    folder = file.parent.absolute()
+    lines = ["Manifest-Version: 1.0", "Created-By: eclipse_vscode_light_converter"]
+    if len(jars) != 0:
+        lines.extend(manifest_header_lines("Class-Path", " ".join(map(lambda x: class_path_url(x, folder), jars))))
+    manifest = ("\r\n".join(lines) + "\r\n\r\n").encode("utf-8")
+    # a fixed date makes the jar the same for the same jars, an unchanged jar is not written
+    info = zipfile.ZipInfo(manifest_path, date_time=(1980, 1, 1, 0, 0, 0))
+    temp_file = file.with_name(file.name + ".tmp")
+    with zipfile.ZipFile(temp_file, "w", zipfile.ZIP_DEFLATED) as jar:
+        jar.writestr(info, manifest)
+    if file.is_file() and file.read_bytes() == temp_file.read_bytes():
+        os.remove(temp_file)
+        return False
+    os.replace(temp_file, file)
+    return True
+
+
+class ClasspathFile:
+    '''.classpath split around the generated section: the hand-written entries, the generated ones and the closing tag.
+    Other lines are kept byte for byte so that converting back gives the original file
+    '''
+    __slots__ = ("text", "head", "generated", "tail", "merged")
+
+    def __init__(self, text: str):
+        self.text = text
+        lines = text.splitlines(keepends=True)
+        ends = list(filter(lambda x: x[1].find(classpath_end_tag) >= 0, enumerate(lines)))
+        if len(ends) == 0:
+            raise ValueError(f"no {classpath_end_tag} in the classpath file")
+        end = ends[-1][0]
+        starts = list(filter(lambda x: x[1].find(classpath_autogen_marker) >= 0, enumerate(lines[:end])))
+        self.merged = len(starts) != 0
+        if self.merged:
+            start = starts[0][0]
+            self.head = lines[:start]
+            self.generated = lines[start + 1:end]
+        else:
+            self.head = lines[:end]
+            self.generated = []
+        self.tail = lines[end:]
+
+    @staticmethod
+    def read(file: Path) -> 'ClasspathFile':
+        with file.open('r') as readable:
+            return ClasspathFile(readable.read())
+
+    def source_folders(self) -> List[str]:
+        '''Source folders of the project itself, other projects are referenced with a leading /
+        '''
+        folders = []
+        for line in self.head:
+            kind = classpath_entry_kind_pattern.search(line)
+            path = classpath_entry_path_pattern.search(line)
+            if kind is not None and path is not None and kind.group(1) == "src" and not path.group(1).startswith("/"):
+                folders.append(path.group(1))
+        return folders
+
+    def set_generated(self, lines: List[str]):
+        self.generated = list(lines)
+        self.merged = True
+
+    def remove_generated(self):
+        self.generated = []
+        self.merged = False
+
+    def render(self) -> str:
+        marker = [f"{classpath_autogen_marker}\n"] if self.merged else []
+        return "".join(self.head + marker + self.generated + self.tail)
+
+    def write(self, file: Path) -> bool:
+        '''Replaces the file at once and only if its content changed, returns True if it was written
+        '''
+        text = self.render()
+        if text == self.text:
+            # the language server would re-index the project for nothing
+            return False
+        temp_file = file.with_name(file.name + ".tmp")
+        with temp_file.open('w') as writable:
+            writable.write(text)
+        os.replace(temp_file, file)
+        self.text = text
+        return True
+
+
+def merge_dependencies_with_classpath(file: Path, dependencies: List[str], projects: List[str] = [],
+                                      sources: dict = {}) -> bool:
+    classpath = ClasspathFile.read(file)
+    classpath.set_generated(classpath_lines(dependencies, projects, sources))
+    return classpath.write(file)
+
+
+def patch_classpath(file: Path, previous_lines: List[str], new_lines: List[str]) -> bool:
+    '''Removes generated lines that are not needed anymore and adds the new ones, the rest stays untouched.
+    Returns False if the generated part is not the one made from previous_lines
+    '''
+    classpath = ClasspathFile.read(file)
+    generated = classpath.generated
+    if not classpath.merged or set(generated) != set(previous_lines):
+        return False
+    new_set = set(new_lines)
+    generated_set = set(generated)
+    kept = list(filter(lambda x: x in new_set, generated))
+    added = list(filter(lambda x: x not in generated_set, new_lines))
+    classpath.set_generated(kept + added)
+    if classpath.write(file):
+        report(f"{file}: {len(added)} entries added, {len(generated) - len(kept)} removed")
+    return True
 
 
 def clean_classpath(file: Path):
-    lines = []
-    with file.open('r+') as opened_file:
-        lines = opened_file.readlines()
-    generation_start_index = -1
-    generation_end_index = -1
-    end_pattern = re.compile(r".*</classpath>.*")
-    machine_pattern = classpath_autogen_line_pattern
-    for index, line in enumerate(lines):
-        if re.match(machine_pattern, line.strip()):
-            generation_start_index = index
-        if (re.match(end_pattern, line.strip())):
-            generation_end_index = index
+    classpath = ClasspathFile.read(file)
     # don't clean the file if no special lines were found
-    if generation_start_index == -1:
-        print("already converted to eclipse")
+    if not classpath.merged:
+        report("already converted to eclipse")
         return
-    first_part = lines[:generation_start_index]
-    end_part = lines[generation_end_index:]
-    first_part.extend(end_part)
-    with file.open('w+') as opened_file:
-        opened_file.writelines(first_part)
-    
+    classpath.remove_generated()
+    classpath.write(file)
+
+
 def configure_vs_code_settings(project_path: Path):
     dir = project_path.joinpath(vscode_settings_folder)
     if not dir.exists():
@@ -494,9 +2231,14 @@ def configure_vs_code_settings(project_path: Path):
             pass
     else:
         file.touch()
+    changed = len(jobj) == 0
     for key, value in zip(vscode_settings.keys(), vscode_settings.values()):
         if (key not in jobj):
             jobj[key] = value
+            changed = True
+    # rewriting an unchanged file would make VS Code reload the settings
+    if not changed:
+        return
     with file.open('w') as writable:
         dump(jobj, writable, indent=4)
     
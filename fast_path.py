@@ -0,0 +1,151 @@
+'''Checks whether converting to code would change nothing, before the converter itself is imported.
+Only os, json and hashlib are loaded here: a warm run reads the closure caches and exits
+without paying for argparse, zipfile, sqlite3, the manifest parsers and the resolver.
+The file names and the cache fingerprint are defined here, dependency.py uses the same ones
+'''
+import hashlib
+import json
+import os
+
+manifest_path = "META-INF/MANIFEST.MF"
+classpath_file_subpath = ".classpath"
+settings_file_subpath = ".settings/org.eclipse.jdt.core.prefs"
+settings_magic_line = "org.eclipse.jdt.core.compiler.problem.forbiddenReference=ignore"
+classpath_autogen_marker = "<!-- BELOW AUTO GEN -->"
+classpath_end_tag = "</classpath>"
+plugins_subpath = "pool/plugins"
+# version of the <module>.etvsc closure cache, part of its fingerprint
+closure_cache_format = 8
+vscode_settings_folder = ".vscode/"
+vscode_settings_subpath = ".vscode/settings.json"
+vscode_settings = { "java.import.maven.enabled": False, "java.autobuild.enabled": False}
+# options that keep the conversion a plain to code one, by the number of values they take
+fast_path_options = {"-p2": 1, "--p2repository": 1, "-cache_path": 1, "-j": 1, "--jobs": 1,
+                     "-cc": 0, "--convert_to_code": 0, "-incremental": 0}
+
+
+def pool_listing_digest(jar_names) -> str:
+    '''Hash of the jar names of a pool: p2 never changes a jar in place, a new version gets a new name
+    '''
+    return hashlib.sha256("\n".join(sorted(jar_names)).encode('utf8')).hexdigest()
+
+
+def file_digest(file) -> str:
+    with open(file, 'rb') as opened_file:
+        return hashlib.sha256(opened_file.read()).hexdigest()
+
+
+def listed_pool_digest(p2: str) -> str:
+    plugins = os.path.join(p2, plugins_subpath)
+    jar_names = []
+    if os.path.isdir(plugins):
+        with os.scandir(plugins) as listing:
+            jar_names = list(map(lambda x: x.name, filter(lambda x: x.name.endswith(".jar"), listing)))
+    return pool_listing_digest(jar_names)
+
+
+def parse_arguments(argv):
+    '''(project path, modules, p2, cache folder) when argv asks for nothing but a conversion to code, None otherwise.
+    Every other option (-ce, -clean_cache, -prune, --plan, -w, -batch, profiling...) goes through the converter
+    '''
+    positionals = []
+    options = {}
+    remaining = list(argv)
+    while len(remaining) != 0:
+        argument = remaining.pop(0)
+        name, _, value = argument.partition("=")
+        if not argument.startswith("-"):
+            positionals.append(argument)
+        elif name not in fast_path_options:
+            return None
+        elif fast_path_options[name] == 0:
+            options[name] = True
+        elif value != "":
+            options[name] = value
+        elif len(remaining) != 0:
+            options[name] = remaining.pop(0)
+        else:
+            return None
+    p2 = options.get("-p2", options.get("--p2repository"))
+    cache_folder = options.get("-cache_path")
+    if len(positionals) != 2 or p2 is None or cache_folder is None:
+        return None
+    modules = list(map(lambda x: x.strip(), positionals[1].strip().split()))
+    return positionals[0], modules, p2, cache_folder
+
+
+def read_text(file):
+    try:
+        with open(file, 'r') as opened_file:
+            return opened_file.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def classpath_merged(text: str) -> bool:
+    '''The marker is on a line before the last </classpath>, as ClasspathFile reads it
+    '''
+    end = text.rfind(classpath_end_tag)
+    marker = text.find(classpath_autogen_marker)
+    return end >= 0 and 0 <= marker < text.rfind("\n", 0, end) + 1
+
+
+def has_magic_line(text: str) -> bool:
+    key, _, value = settings_magic_line.partition("=")
+    for line in text.splitlines():
+        _, found, rest = line.partition(key)
+        if found and rest.lstrip().startswith("=") and rest.lstrip()[1:].lstrip().startswith(value):
+            return True
+    return False
+
+
+def vs_code_configured(project_path: str) -> bool:
+    text = read_text(os.path.join(project_path, vscode_settings_subpath))
+    try:
+        settings = json.loads(text) if text is not None else None
+    except ValueError:
+        return False
+    return isinstance(settings, dict) and all(map(lambda x: x in settings, vscode_settings.keys()))
+
+
+def module_converted(module_path: str, cache_file: str, pool_fingerprint: dict) -> bool:
+    classpath = read_text(os.path.join(module_path, classpath_file_subpath))
+    settings = read_text(os.path.join(module_path, settings_file_subpath))
+    if classpath is None or settings is None or not classpath_merged(classpath) or not has_magic_line(settings):
+        return False
+    cache_text = read_text(cache_file)
+    manifest = os.path.join(module_path, manifest_path)
+    if cache_text is None or not os.path.isfile(manifest):
+        return False
+    try:
+        cache = json.loads(cache_text)
+    except ValueError:
+        return False
+    fingerprint = dict(pool_fingerprint, manifest=file_digest(manifest))
+    # a classpath made in the -classpath_jar mode is converted again, the fast path is for the default mode
+    return isinstance(cache, dict) and cache.get("fingerprint") == fingerprint and not cache.get("classpath_jar", False)
+
+
+def already_converted(argv) -> bool:
+    '''True if every module was converted to code from its current manifest and the current p2 pool,
+    then the conversion would rewrite nothing
+    '''
+    arguments = parse_arguments(argv)
+    if arguments is None:
+        return False
+    project_path, modules, p2, cache_folder = arguments
+    if len(modules) == 0 or not vs_code_configured(project_path):
+        return False
+    try:
+        pool_fingerprint = {
+            "format": closure_cache_format,
+            "p2": os.path.abspath(p2),
+            "pool": listed_pool_digest(p2),
+        }
+        converted = all(map(lambda x: module_converted(
+            os.path.join(project_path, x), os.path.join(cache_folder, f"{x}.etvsc"), pool_fingerprint), modules))
+    except OSError:
+        return False
+    if converted:
+        list(map(lambda x: print(f"{x}: already converted to code"), modules))
+    return converted
@@ -0,0 +1,61 @@
+"""Polling file watcher used by the --watch mode of classpath_installer.py.
+Polling is used instead of inotify/FSEvents/ReadDirectoryChangesW so that it works
+the same way on every platform without extra packages; watching a handful of
+manifests and one folder costs a few stat calls per interval.
+"""
+import os
+import time
+from typing import Callable, List
+
+
+def snapshot(path: str):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class PollingWatcher:
+    '''Calls back with the changed paths once they stopped changing for `debounce` seconds.
+    A folder is reported when entries are added to or removed from it.
+    '''
+    def __init__(self, paths: List[str], interval: float = 0.1, debounce: float = 0.3):
+        self.paths = list(map(lambda x: str(x), paths))
+        self.interval = interval
+        self.debounce = debounce
+        self.snapshots = dict(map(lambda x: (x, snapshot(x)), self.paths))
+        self.running = False
+
+    def changes(self) -> List[str]:
+        changed = []
+        for path in self.paths:
+            current = snapshot(path)
+            if current != self.snapshots[path]:
+                self.snapshots[path] = current
+                changed.append(path)
+        return changed
+
+    def stop(self):
+        self.running = False
+
+    def run(self, on_change: Callable[[List[str]], None]):
+        self.running = True
+        pending = set()
+        last_change = 0.0
+        while self.running:
+            time.sleep(self.interval)
+            changed = self.changes()
+            now = time.monotonic()
+            if len(changed) != 0:
+                pending.update(changed)
+                last_change = now
+            elif len(pending) != 0 and now - last_change >= self.debounce:
+                # editors save in several steps, wait until the files settle
+                paths = sorted(pending)
+                pending.clear()
+                try:
+                    on_change(paths)
+                except Exception as error:
+                    # e.g. a file moved away for a moment by a checkout, the next change is handled again
+                    print(f"could not handle changes of {', '.join(paths)}: {error!r}")